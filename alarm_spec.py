@@ -0,0 +1,75 @@
+from collections import namedtuple
+from config import RESOURCE_DIMENSIONS_MAP
+
+ALARM_SPEC_FIELDS = ("region", "resource_arn", "namespace", "sns_topic_arn", "metric_name", "statistic", "comparison_operator",
+                     "threshold", "datapoints", "dimensions", "alarm_name")
+
+# Keys of the alarm data dicts used before AlarmSpec, kept for logs and serialized alarms
+ALARM_SPEC_KEYS = ("Region", "ResourceARN", "Namespace", "SNSTopicARN", "AlarmMetrics", "Statistic", "ComparisonOperator",
+                   "Threshold", "Datapoints", "Dimensions", "AlarmName")
+
+
+class AlarmSpec(namedtuple("AlarmSpec", ALARM_SPEC_FIELDS)):
+    # Immutable and without a per instance __dict__; dimensions is a tuple of (name, value) pairs
+    __slots__ = ()
+
+    def get_dimensions_list(self):
+        return [{"Name": name, "Value": value} for name, value in self.dimensions]
+
+    def to_dict(self):
+        alarm_data = dict(zip(ALARM_SPEC_KEYS, self))
+        alarm_data["Dimensions"] = self.get_dimensions_list()
+        return alarm_data
+
+    @classmethod
+    def from_dict(cls, alarm_data):
+        values = [alarm_data[key] for key in ALARM_SPEC_KEYS]
+        values[ALARM_SPEC_KEYS.index("Dimensions")] = tuple((dimension["Name"], dimension["Value"]) for dimension in alarm_data["Dimensions"])
+        return cls(*values)
+
+
+# How the single dimension value of each namespace is cut out of the resource ARN
+def get_instance_id(resource_arn):
+    return resource_arn.rsplit('/', 1)[-1]
+
+
+def get_arn_resource_id(resource_arn):
+    return resource_arn.rsplit(':', 1)[-1]
+
+
+def get_load_balancer_id(resource_arn):
+    return resource_arn.rsplit(':', 1)[-1].split("loadbalancer/")[-1]
+
+
+DIMENSION_VALUE_EXTRACTORS = {
+    "AWS/EC2": get_instance_id,
+    "ElasticBeanstalk/CWAgent": get_instance_id,
+    "AWS/ElastiCache": get_arn_resource_id,
+    "AWS/SQS": get_arn_resource_id,
+    "AWS/RDS": get_arn_resource_id,
+    "AWS/ApplicationELB": get_load_balancer_id,
+}
+
+
+def compile_dimension_templates(resource_dimensions_map):
+    # namespace -> (dimension names, ARN value extractor)
+    templates = {}
+    for namespace, dimensions in resource_dimensions_map.items():
+        extractor = DIMENSION_VALUE_EXTRACTORS.get(namespace)
+        if extractor is None:
+            continue
+        templates[namespace] = (tuple(dimension["Name"] for dimension in dimensions), extractor)
+    return templates
+
+
+# Compiled once at import
+DIMENSION_TEMPLATES = compile_dimension_templates(RESOURCE_DIMENSIONS_MAP)
+
+
+def render_dimensions(resource_arn, namespace):
+    template = DIMENSION_TEMPLATES.get(namespace)
+    if template is None:
+        return ()
+    dimension_names, extractor = template
+    value = extractor(resource_arn)
+    return tuple((name, value) for name in dimension_names)
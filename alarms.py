@@ -1,45 +1,56 @@
-import boto3
+import logging
+from clients import get_client
 from logger import configure_logger
-from resources import Resources
-from config import LOGS_LEVEL, SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST, FAILED_TO_CREATE_ALARM_RESOURCE_LIST, ALARM_PERIOD
+from metrics import recorder
+from config import LOGS_LEVEL, ALARM_PERIOD
 
 logger = configure_logger(file_name="alarms.py", logs_level=LOGS_LEVEL)
 
 class Alarm:
-    def __init__(self):
-        self.cloudwatch_client = boto3.client('cloudwatch')
-        # Create an instance of the Resources class
-        self.resource = Resources()
-
-    def set_alarm(self, alarm_config):
-        try:
-            response = self.cloudwatch_client.put_metric_alarm(
-                AlarmName=alarm_config['AlarmName'],
-                AlarmDescription=f"This is a lambda generated alarm for {alarm_config['AlarmMetrics']}",
-                Namespace=alarm_config['Namespace'],
-                MetricName=alarm_config['AlarmMetrics'],
-                Dimensions=alarm_config['Dimensions'],
-                Threshold=float(alarm_config['Threshold']),
-                ComparisonOperator=alarm_config['ComparisonOperator'],
-                Statistic=alarm_config['Statistic'],
-                AlarmActions=[alarm_config['SNSTopicARN']],
-
-                EvaluationPeriods=int(alarm_config['Datapoints']),
-                DatapointsToAlarm=int(alarm_config['Datapoints']),
-                Period=ALARM_PERIOD,
-
-                ActionsEnabled=True,
-                TreatMissingData='missing',
+    @staticmethod
+    def build_alarm_params(alarm_config):
+        return {
+            "AlarmName": alarm_config.alarm_name,
+            "AlarmDescription": f"This is a lambda generated alarm for {alarm_config.metric_name}",
+            "Namespace": alarm_config.namespace,
+            "MetricName": alarm_config.metric_name,
+            "Dimensions": alarm_config.get_dimensions_list(),
+            "Threshold": float(alarm_config.threshold),
+            "ComparisonOperator": alarm_config.comparison_operator,
+            "Statistic": alarm_config.statistic,
+            "AlarmActions": [alarm_config.sns_topic_arn],
 
+            "EvaluationPeriods": int(alarm_config.datapoints),
+            "DatapointsToAlarm": int(alarm_config.datapoints),
+            "Period": ALARM_PERIOD,
+
+            "ActionsEnabled": True,
+            "TreatMissingData": 'missing',
+        }
+
+    @staticmethod
+    def get_log_fields(alarm_config, stage=None):
+        return {"region": alarm_config.region, "resource_arn": alarm_config.resource_arn, "alarm_name": alarm_config.alarm_name, "stage": stage}
+
+    @staticmethod
+    def put_alarm(alarm_config):
+        # Alarms live in the region of the resource they watch
+        cloudwatch_client = get_client('cloudwatch', alarm_config.region)
+        with recorder.time_call("put_metric_alarm", region=alarm_config.region):
+            response = cloudwatch_client.put_metric_alarm(
+                **Alarm.build_alarm_params(alarm_config),
                 Tags=[{'Key': 'Purpose', 'Value': 'Automated Cloudwatch Alarm'}])
+        # Checked first, the fields are not even built when DEBUG is off
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Alarm successfully set: %s", response, extra=Alarm.get_log_fields(alarm_config, stage="put_metric_alarm"))
+        return response
 
-            # Adding the Resource ARN to SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST
-            SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST.add(alarm_config["ResourceARN"])
-            
-            logger.debug("Alarm successfully set: %s", response)
-            logger.debug("")
+    @staticmethod
+    def record_alarm_result(alarm_config, run_context, outcome="create", error=None):
+        if error is None:
+            run_context.record_alarm_outcome(alarm_config, outcome)
             return "Success"
-        except Exception as e:
-            FAILED_TO_CREATE_ALARM_RESOURCE_LIST.add(alarm_config["ResourceARN"])
-            logger.error("Error setting alarm: %s", e)
-            return "Error"
+
+        run_context.record_alarm_outcome(alarm_config, "failed", error=error)
+        logger.error("Error setting alarm: %s", error, extra=Alarm.get_log_fields(alarm_config))
+        return "Error"
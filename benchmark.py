@@ -0,0 +1,166 @@
+import argparse
+import datetime
+import json
+import logging
+import time
+import tracemalloc
+import clients
+from fake_aws import FakeAWS
+from config import MONITORING_TAG_NAME, MONITORING_TAG_VALUE, MONITORING_TAGS_PREFIX, SUCCESSFULL_MONITORING_TAG_VALUE, SNS_TOPIC_ARNS
+from resources import Resources
+from utility import AlarmUtility
+from alarms import Alarm
+from dispatcher import AdaptiveDispatcher
+from pipeline import AlarmPipeline
+from validation import validate_alarm_specs
+from run_context import RunContext
+
+# Offline benchmark of the alarm pipeline against fake_aws, one timing per stage:
+#   python benchmark.py --sizes 1000 10000 100000 --output benchmark_results.json
+# Results go to benchmark_results.json by default, ignored by git; keep a copy as the --baseline of later runs.
+
+
+def run_stage(name, fn, items_count, fake_aws, track_memory):
+    fake_aws.reset_counters()
+    if track_memory:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start_time
+    peak_memory = None
+    if track_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, {
+        "stage": name,
+        "items": items_count,
+        "seconds": elapsed,
+        "items_per_second": items_count / elapsed if elapsed > 0 else None,
+        "peak_memory_bytes": peak_memory,
+        "api_calls": dict(fake_aws.call_counts),
+        "throttles": dict(fake_aws.throttle_counts),
+    }
+
+
+def new_dispatcher(args):
+    return AdaptiveDispatcher(initial_concurrency=args.concurrency, max_concurrency=args.concurrency,
+                              initial_rate=args.dispatch_rate, max_rate=args.dispatch_rate)
+
+
+def benchmark_fleet(size, args):
+    fake_aws = FakeAWS(latency=args.latency, throttle_probability=args.throttle_probability,
+                       rate_limits={"put_metric_alarm": args.put_rate_limit} if args.put_rate_limit else None)
+    fake_aws.add_synthetic_fleet(size, args.regions, monitoring_tags_prefix=MONITORING_TAGS_PREFIX, sns_topic_arn=SNS_TOPIC_ARNS[0])
+    clients.set_client_factory(fake_aws.client)
+    run_context = RunContext()
+    stages = []
+
+    def discover():
+        resources_data = []
+        for region in args.regions:
+            resources_data.extend(Resources().get_resources(region=region, tag_name=MONITORING_TAG_NAME, tag_value=MONITORING_TAG_VALUE,
+                                                            monitoring_tags_prefix=MONITORING_TAGS_PREFIX))
+        return resources_data
+
+    resources_data, stage = run_stage("discovery", discover, size, fake_aws, args.track_memory)
+    stages.append(stage)
+
+    alarms_data, stage = run_stage("process_data", lambda: AlarmUtility.process_data(resources_data), len(resources_data), fake_aws, args.track_memory)
+    stages.append(stage)
+
+    valid_alarms_data, stage = run_stage("validate_alarm_data", lambda: [result.alarm_spec for result in validate_alarm_specs(alarms_data) if result.is_valid],
+                                         len(alarms_data), fake_aws, args.track_memory)
+    stages.append(stage)
+
+    def set_alarms():
+        dispatcher = new_dispatcher(args)
+        for alarm_data in valid_alarms_data:
+            dispatcher.submit(alarm_data.region, Alarm.put_alarm, alarm_data,
+                              on_done=lambda alarm_data, error=None: Alarm.record_alarm_result(alarm_data, run_context, error=error))
+        return dispatcher.wait()
+
+    dispatch_stats, stage = run_stage("set_alarm", set_alarms, len(valid_alarms_data), fake_aws, args.track_memory)
+    stage["dispatch"] = {key: value for key, value in dispatch_stats.items() if key != "region_rates"}
+    stages.append(stage)
+
+    successful_resources = run_context.get_successful_resources()
+    _, stage = run_stage("modify_tag_value", lambda: Resources().modify_tag_value(successful_resources, MONITORING_TAG_NAME, SUCCESSFULL_MONITORING_TAG_VALUE),
+                         len(successful_resources), fake_aws, args.track_memory)
+    stages.append(stage)
+
+    # Streaming end to end run on a fresh fleet, the alarms from the stage runs count as existing
+    for region_resources in fake_aws.resources.values():
+        for tags in region_resources.values():
+            tags[MONITORING_TAG_NAME] = MONITORING_TAG_VALUE
+    run_context.release()
+    pipeline_stats, stage = run_stage("pipeline", lambda: AlarmPipeline(regions=args.regions, run_context=RunContext(), dispatcher=new_dispatcher(args)).run(),
+                                      size, fake_aws, args.track_memory)
+    stage["pipeline"] = {key: value for key, value in pipeline_stats.items() if key != "dispatch"}
+    stages.append(stage)
+
+    clients.set_client_factory(None)
+    return {"fleet_size": size, "alarms": len(alarms_data), "stages": stages}
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    baseline_stages = {(fleet["fleet_size"], stage["stage"]): stage for fleet in baseline["fleets"] for stage in fleet["stages"]}
+
+    regressions = []
+    for fleet in results["fleets"]:
+        for stage in fleet["stages"]:
+            baseline_stage = baseline_stages.get((fleet["fleet_size"], stage["stage"]))
+            if baseline_stage and baseline_stage["seconds"] and stage["seconds"] > baseline_stage["seconds"] * (1 + tolerance):
+                regressions.append(f"{fleet['fleet_size']} {stage['stage']}: {baseline_stage['seconds']:.3f}s --> {stage['seconds']:.3f}s")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'fleet':>8} {'stage':<20} {'items':>8} {'seconds':>9} {'items/s':>11} {'peak MiB':>9}  api calls")
+    for fleet in results["fleets"]:
+        for stage in fleet["stages"]:
+            peak_memory = f"{stage['peak_memory_bytes'] / 2 ** 20:.1f}" if stage["peak_memory_bytes"] is not None else "-"
+            items_per_second = f"{stage['items_per_second']:.0f}" if stage["items_per_second"] else "-"
+            print(f"{fleet['fleet_size']:>8} {stage['stage']:<20} {stage['items']:>8} {stage['seconds']:>9.3f} {items_per_second:>11} {peak_memory:>9}  {stage['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the alarm pipeline against a fake AWS")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="synthetic fleet sizes")
+    parser.add_argument("--regions", nargs="+", default=["us-west-2", "us-east-1"])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake API call")
+    parser.add_argument("--throttle-probability", type=float, default=0.0)
+    parser.add_argument("--put-rate-limit", type=float, default=None, help="put_metric_alarm calls/sec per region before throttling")
+    parser.add_argument("--concurrency", type=int, default=16, help="dispatcher concurrency")
+    parser.add_argument("--dispatch-rate", type=float, default=100000, help="dispatcher calls/sec per region")
+    parser.add_argument("--no-memory", dest="track_memory", action="store_false", help="skip tracemalloc, it slows every stage down")
+    parser.add_argument("--output", default="benchmark_results.json", help="results file, ignored by git by default")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    # Keep per alarm logs out of the timings
+    logging.disable(logging.WARNING)
+
+    results = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "fleets": [benchmark_fleet(size, args) for size in args.sizes],
+    }
+    print_results(results)
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import json
+from abc import ABC, abstractmethod
+import os
+import time
+from files import atomic_write
+from logger import configure_logger
+from config import LOGS_LEVEL, CHECKPOINT_PATH, CHECKPOINT_MAX_AGE, DEADLINE_SAFETY_MARGIN_MS
+
+logger = configure_logger(file_name="checkpoints.py", logs_level=LOGS_LEVEL)
+
+CHECKPOINT_VERSION = 1
+
+
+class Deadline:
+    # When the invocation has to stop, from the Lambda context; without a context (local runs) there is none
+    def __init__(self, context=None, safety_margin_ms=DEADLINE_SAFETY_MARGIN_MS):
+        self.context = context
+        self.safety_margin_ms = safety_margin_ms
+
+    def get_remaining_seconds(self):
+        # None when there is no deadline
+        if self.context is None or not hasattr(self.context, "get_remaining_time_in_millis"):
+            return None
+        return max(0.0, (self.context.get_remaining_time_in_millis() - self.safety_margin_ms) / 1000)
+
+    def is_reached(self):
+        remaining_seconds = self.get_remaining_seconds()
+        return remaining_seconds is not None and remaining_seconds <= 0
+
+
+class LocalContext:
+    # Stands in for the Lambda context in local runs and benchmarks: lambda_handler(event, LocalContext(timeout_ms=60000))
+    def __init__(self, timeout_ms):
+        self.deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class CheckpointStore(ABC):
+    # Holds the state of a full scan stopped at the deadline: pagination tokens, pending alarm specs and results so far
+
+    @abstractmethod
+    def load(self):
+        pass
+
+    @abstractmethod
+    def save(self, checkpoint):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class FileCheckpointStore(CheckpointStore):
+    def __init__(self, path=CHECKPOINT_PATH, max_age=CHECKPOINT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+
+    def load(self):
+        # Returns None when there is nothing to resume
+        try:
+            with open(self.path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # An unreadable checkpoint only costs a scan from the start
+            logger.error(f"Error reading checkpoint: {e}")
+            return None
+
+        if checkpoint.get("version") != CHECKPOINT_VERSION or time.time() - checkpoint.get("saved_at", 0) > self.max_age:
+            logger.info("Dropping outdated checkpoint")
+            self.clear()
+            return None
+        return checkpoint
+
+    def save(self, checkpoint):
+        try:
+            checkpoint = dict(checkpoint, version=CHECKPOINT_VERSION, saved_at=time.time())
+            with atomic_write(self.path) as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file, separators=(',', ':'))
+            return True
+        except Exception as e:
+            logger.error(f"Error writing checkpoint: {e}")
+            return False
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error removing checkpoint: {e}")
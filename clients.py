@@ -0,0 +1,49 @@
+import threading
+from config import CLIENT_MAX_POOL_CONNECTIONS, DEFAULT_CLIENT_MAX_POOL_CONNECTIONS
+
+# Module scope on purpose: warm Lambda invocations reuse the same clients and their connection pools
+_session = None
+_clients = {}
+_clients_lock = threading.Lock()
+# Replaces boto3 when set, e.g. by the offline benchmark: factory(service_name, region) -> client
+_client_factory = None
+
+
+def get_client(service_name, region=None):
+    key = (service_name, region)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        # Another thread may have built it while we were waiting for the lock
+        client = _clients.get(key)
+        if client is None and _client_factory is not None:
+            client = _client_factory(service_name, region)
+            _clients[key] = client
+        if client is None:
+            # boto3 is imported on first use only, it dominates the cold start import time
+            import boto3
+            from botocore.config import Config
+
+            global _session
+            if _session is None:
+                _session = boto3.session.Session()
+            client_config = Config(max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS.get(service_name, DEFAULT_CLIENT_MAX_POOL_CONNECTIONS))
+            client = _session.client(service_name, region_name=region, config=client_config)
+            _clients[key] = client
+        return client
+
+
+def set_client_factory(factory):
+    global _client_factory
+    with _clients_lock:
+        _client_factory = factory
+    clear_clients()
+
+
+def clear_clients():
+    global _session
+    with _clients_lock:
+        _clients.clear()
+        _session = None
@@ -1,7 +1,96 @@
+from collections import namedtuple
+
 LOGS_LEVEL = "INFO" ##'CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'NOTSET'
+# "json" writes one JSON object per record with run_id, region and resource_arn when known, "text" the plain format
+LOGS_FORMAT = "json"
+# Keep one in N DEBUG records of the stages logging once per alarm or per call, the others log everything
+LOGS_DEBUG_SAMPLING = {"put_metric_alarm": 100, "reconcile": 100, "dispatch": 10}
+# Empty for every region enabled in the account, listed once per container with EC2 describe_regions
 regions=["us-west-2"]
 
-SET_ALARMS_WORKER = 1
+# Adaptive put_metric_alarm dispatcher: concurrency grows until CloudWatch throttles (AIMD)
+DISPATCH_INITIAL_CONCURRENCY = 2
+DISPATCH_MAX_CONCURRENCY = 32
+# Per region token bucket, calls per second
+DISPATCH_INITIAL_RATE = 3
+DISPATCH_MIN_RATE = 0.5
+DISPATCH_MAX_RATE = 100
+DISPATCH_RATE_INCREASE_STEP = 5
+DISPATCH_DECREASE_FACTOR = 0.5
+DISPATCH_DECREASE_COOLDOWN = 1.0
+# Throttled calls are retried with exponential backoff and full jitter
+DISPATCH_MAX_RETRIES = 8
+DISPATCH_BACKOFF_BASE = 0.2
+DISPATCH_BACKOFF_CAP = 20
+# Alarms waiting in the dispatcher before the pipeline stops feeding it
+DISPATCH_MAX_PENDING = 1000
+
+# Streaming pipeline, bounded buffers between discovery, parsing and dispatch (in pages of resources)
+PIPELINE_QUEUE_SIZE = 4
+
+# Incremental discovery: resources already tagged '2' are discovered too and processed again when their Enpass:Monitoring:*
+# tags changed since their alarms were last set, Enabled left aside. Resources tagged '1' are always processed.
+# /tmp survives warm Lambda invocations only, point it at persistent storage to keep it across cold starts.
+INCREMENTAL_DISCOVERY = True
+FINGERPRINT_STORE_PATH = "/tmp/automated-cloudwatch-alarms-fingerprints.sqlite3"
+
+# Alarms whose put_metric_alarm failed are retried by later runs, with exponential backoff, before their resource is tagged '3'.
+# /tmp survives warm Lambda invocations only: a cold container starts with an empty journal and attempts start over at 1,
+# so a permanently failing alarm never reaches RETRY_JOURNAL_MAX_ATTEMPTS and its resource stays at '1'. Point it at storage
+# shared by every invocation, e.g. an EFS mount, for scheduled runs that land on cold containers.
+RETRY_JOURNAL_ENABLED = True
+RETRY_JOURNAL_PATH = "/tmp/automated-cloudwatch-alarms-retries.sqlite3"
+# put_metric_alarm attempts of an alarm, the first one included
+RETRY_JOURNAL_MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled after every failed attempt
+RETRY_JOURNAL_BASE_DELAY = 300
+RETRY_JOURNAL_MAX_DELAY = 21600
+
+# Stop this long before the Lambda timeout and save a checkpoint the next invocation resumes from
+DEADLINE_SAFETY_MARGIN_MS = 30000
+CHECKPOINTS_ENABLED = True
+# /tmp only survives in the same warm container, a shared mount (e.g. EFS) lets any container resume
+CHECKPOINT_PATH = "/tmp/automated-cloudwatch-alarms-checkpoint.json"
+# Older checkpoints are dropped, get_resources pagination tokens do not live much longer
+CHECKPOINT_MAX_AGE = 3600
+
+# Plan/apply split: {"mode": "plan"} writes the desired alarms to a gzip JSONL plan and a summary next to it,
+# {"mode": "apply"} sets the alarms of the plan and flips the tags without discovery. "plan_path" in the event overrides it.
+PLAN_PATH = "/tmp/automated-cloudwatch-alarms-plan.jsonl.gz"
+
+# Sharded runs: {"shard_index": i, "shard_count": n} sets the alarms of the resources of shard i and saves its results here,
+# {"mode": "merge", "shard_count": n} then combines the n results and flips the tags.
+# A full scan shards discovery: every (region, resource type) stream is paged by one shard, so the n shards make the
+# get_resources calls of a single run between them. More shards than streams leave the extra ones idle, and a shard
+# owning the largest type takes as long as that type. An apply splits the plan by ARN hash instead.
+# Like the other paths it must be shared storage when the shards run in different containers.
+SHARD_RESULTS_PATH = "/tmp/automated-cloudwatch-alarms-shards"
+# Older shard results are not merged, their resources are picked up again by the next run
+SHARD_RESULTS_MAX_AGE = 3600
+
+# Validate alarm metrics against an index of list_metrics per (region, namespace) instead of METRICS_VALIDATION_MAP.
+# A metric is only listed once it has datapoints, new resources fail validation until they publish it.
+DYNAMIC_METRIC_VALIDATION = False
+# Seconds a metric index is reused across warm invocations
+METRIC_INDEX_TTL = 900
+# Seconds validation falls back to METRICS_VALIDATION_MAP after a failed list_metrics scan before trying it again
+METRIC_INDEX_FAILURE_TTL = 60
+
+# Concurrent tag_resources calls when flipping the monitoring tag, and retries of throttled chunks
+MODIFY_TAGS_WORKER = 4
+MODIFY_TAGS_MAX_RETRIES = 8
+
+# Per stage metrics printed as one CloudWatch Embedded Metric Format document at the end of each invocation
+EMIT_METRICS = True
+METRICS_NAMESPACE = "AutomatedCloudWatchAlarms"
+METRICS_SERVICE_NAME = "automated-cloudwatch-alarms"
+
+# Connection pool sizes of the shared boto3 clients, matched to the number of threads using them
+DEFAULT_CLIENT_MAX_POOL_CONNECTIONS = 10
+CLIENT_MAX_POOL_CONNECTIONS = {
+    "cloudwatch": max(DEFAULT_CLIENT_MAX_POOL_CONNECTIONS, DISPATCH_MAX_CONCURRENCY),
+    "resourcegroupstaggingapi": max(DEFAULT_CLIENT_MAX_POOL_CONNECTIONS, MODIFY_TAGS_WORKER),
+}
 
 MONITORING_TAGS_PREFIX = "Enpass:Monitoring:"
 MONITORING_TAG_NAME = "Enpass:Monitoring:Enabled"
@@ -10,6 +99,9 @@ MONITORING_TAG_VALUE = "1"
 MONITORING_METRIC_PREFIX= "Enpass:Monitoring:Metric:"
 CUSTOM_MONITORING_METRIC_PREFIX = "Enpass:Monitoring:CustomMetric:"
 
+AUTOMATED_ALARM_NAME_PREFIX = "Automated Alarm |"
+DELETE_ORPHANED_ALARMS = False
+
 SUCCESSFULL_MONITORING_TAG_VALUE = "2"
 FAILED_MONITORING_TAG_VALUE = "3"
 
@@ -79,7 +171,41 @@ RESOURCE_DIMENSIONS_MAP = {
    ]
 }
 
+# Tagging API resource type of each namespace, discovery only asks get_resources for these types.
+# The load balancer filter also matches network and classic load balancers, their namespaces still fail validation.
+NAMESPACE_RESOURCE_TYPES = {
+    "AWS/EC2": "ec2:instance",
+    "ElasticBeanstalk/CWAgent": "ec2:instance",
+    "AWS/SQS": "sqs",
+    "AWS/RDS": "rds:db",
+    "AWS/ElastiCache": "elasticache:cluster",
+    "AWS/ApplicationELB": "elasticloadbalancing:loadbalancer",
+}
+# One paginator per type, paged through in parallel
+RESOURCE_TYPE_FILTERS = tuple(sorted({NAMESPACE_RESOURCE_TYPES[namespace] for namespace in RESOURCE_DIMENSIONS_MAP}))
+
+
+# Run level settings used by the handler, built once at import and immutable
+Settings = namedtuple("Settings", ["logs_level", "regions", "monitoring_tags_prefix", "monitoring_tag_name", "monitoring_tag_value",
+                                   "successfull_monitoring_tag_value", "failed_monitoring_tag_value", "delete_orphaned_alarms",
+                                   "incremental_discovery", "emit_metrics", "checkpoints_enabled", "deadline_safety_margin_ms",
+                                   "retry_journal_enabled", "plan_path", "fingerprint_store_path", "retry_journal_path"])
 
-valid_alarms_data = []
-SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST = set()
-FAILED_TO_CREATE_ALARM_RESOURCE_LIST = set()
\ No newline at end of file
+SETTINGS = Settings(
+    logs_level=LOGS_LEVEL,
+    regions=tuple(regions),
+    monitoring_tags_prefix=MONITORING_TAGS_PREFIX,
+    monitoring_tag_name=MONITORING_TAG_NAME,
+    monitoring_tag_value=MONITORING_TAG_VALUE,
+    successfull_monitoring_tag_value=SUCCESSFULL_MONITORING_TAG_VALUE,
+    failed_monitoring_tag_value=FAILED_MONITORING_TAG_VALUE,
+    delete_orphaned_alarms=DELETE_ORPHANED_ALARMS,
+    incremental_discovery=INCREMENTAL_DISCOVERY,
+    emit_metrics=EMIT_METRICS,
+    checkpoints_enabled=CHECKPOINTS_ENABLED,
+    deadline_safety_margin_ms=DEADLINE_SAFETY_MARGIN_MS,
+    retry_journal_enabled=RETRY_JOURNAL_ENABLED,
+    plan_path=PLAN_PATH,
+    fingerprint_store_path=FINGERPRINT_STORE_PATH,
+    retry_journal_path=RETRY_JOURNAL_PATH,
+)
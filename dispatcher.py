@@ -0,0 +1,223 @@
+import concurrent.futures
+import random
+import threading
+import time
+from logger import configure_logger
+from metrics import recorder
+from config import (LOGS_LEVEL, DISPATCH_INITIAL_CONCURRENCY, DISPATCH_MAX_CONCURRENCY, DISPATCH_INITIAL_RATE, DISPATCH_MIN_RATE,
+                    DISPATCH_MAX_RATE, DISPATCH_RATE_INCREASE_STEP, DISPATCH_DECREASE_FACTOR, DISPATCH_DECREASE_COOLDOWN,
+                    DISPATCH_MAX_RETRIES, DISPATCH_BACKOFF_BASE, DISPATCH_BACKOFF_CAP, DISPATCH_MAX_PENDING)
+
+logger = configure_logger(file_name="dispatcher.py", logs_level=LOGS_LEVEL)
+
+THROTTLING_ERROR_CODES = frozenset({
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "SlowDown",
+})
+
+
+def is_throttling_error(error):
+    # botocore ClientError carries the service error code in its response
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def get_backoff_delay(attempt, base=DISPATCH_BACKOFF_BASE, cap=DISPATCH_BACKOFF_CAP):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class DispatchCancelled(Exception):
+    # Handed to on_done for the items cancel() dropped before their call was made
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate=DISPATCH_INITIAL_RATE, min_rate=DISPATCH_MIN_RATE, max_rate=DISPATCH_MAX_RATE):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.last_decrease_at = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        # Allow bursts of up to one second worth of calls
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, cancelled=None):
+        # Returns False when the cancelled event got set while waiting for a token
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_time = (1 - self.tokens) / self.rate
+            if cancelled is None:
+                time.sleep(wait_time)
+            elif cancelled.wait(wait_time):
+                return False
+
+    def increase(self):
+        with self.lock:
+            # Additive increase: roughly DISPATCH_RATE_INCREASE_STEP calls/sec more for every second of clean calls
+            self.rate = min(self.max_rate, self.rate + DISPATCH_RATE_INCREASE_STEP / self.rate)
+
+    def decrease(self):
+        with self.lock:
+            now = time.monotonic()
+            # Calls already in flight get throttled together, back off once per cooldown window
+            if now - self.last_decrease_at < DISPATCH_DECREASE_COOLDOWN:
+                return
+            self.last_decrease_at = now
+            self.refill()
+            self.rate = max(self.min_rate, self.rate * DISPATCH_DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+
+
+class AdaptiveDispatcher:
+    def __init__(self, initial_concurrency=DISPATCH_INITIAL_CONCURRENCY, max_concurrency=DISPATCH_MAX_CONCURRENCY,
+                 max_retries=DISPATCH_MAX_RETRIES, max_pending=DISPATCH_MAX_PENDING, initial_rate=DISPATCH_INITIAL_RATE,
+                 max_rate=DISPATCH_MAX_RATE):
+        self.max_concurrency = max_concurrency
+        self.initial_rate = initial_rate
+        self.max_rate = max_rate
+        self.concurrency_limit = float(min(initial_concurrency, max_concurrency))
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.last_decrease_at = 0.0
+        self.condition = threading.Condition()
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+        # Bounds the submitted but unfinished items, submit() blocks when it is full (backpressure)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.stats = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "throttles": 0, "cancelled": 0}
+        self.cancelled = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.started_at = time.monotonic()
+
+    def get_bucket(self, region):
+        with self.buckets_lock:
+            if region not in self.buckets:
+                self.buckets[region] = TokenBucket(rate=self.initial_rate, max_rate=self.max_rate)
+            return self.buckets[region]
+
+    def count(self, stat):
+        with self.stats_lock:
+            self.stats[stat] += 1
+
+    def acquire_slot(self):
+        # Returns False when the dispatcher got cancelled while waiting for a slot
+        with self.condition:
+            while self.in_flight >= int(self.concurrency_limit):
+                if self.cancelled.is_set():
+                    return False
+                self.condition.wait()
+            self.in_flight += 1
+            return True
+
+    def release_slot(self, throttled):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self.last_decrease_at >= DISPATCH_DECREASE_COOLDOWN:
+                    self.last_decrease_at = now
+                    self.concurrency_limit = max(1.0, self.concurrency_limit * DISPATCH_DECREASE_FACTOR)
+                    logger.debug("Throttled, concurrency limit lowered to %.2f", self.concurrency_limit, extra={"stage": "dispatch"})
+            else:
+                self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+            self.condition.notify_all()
+
+    def run(self, region, fn, item):
+        bucket = self.get_bucket(region)
+        attempt = 0
+        while True:
+            if self.cancelled.is_set() or not self.acquire_slot():
+                raise DispatchCancelled()
+            if not bucket.acquire(self.cancelled):
+                self.release_slot(throttled=False)
+                raise DispatchCancelled()
+            self.count("calls")
+            try:
+                result = fn(item)
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                self.release_slot(throttled=throttled)
+                if not throttled:
+                    raise
+                self.count("throttles")
+                recorder.increment("dispatch.throttles", region=region)
+                bucket.decrease()
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.count("retries")
+                recorder.increment("dispatch.retries", region=region)
+                # Woken up early by cancel()
+                self.cancelled.wait(get_backoff_delay(attempt))
+                continue
+            self.release_slot(throttled=False)
+            bucket.increase()
+            return result
+
+    def execute(self, region, fn, item, on_done):
+        try:
+            try:
+                result = self.run(region, fn, item)
+            except DispatchCancelled as e:
+                self.count("cancelled")
+                recorder.increment("dispatch.cancelled", region=region)
+                if on_done:
+                    on_done(item, error=e)
+                return None
+            except Exception as e:
+                self.count("failed")
+                recorder.increment("dispatch.failed", region=region)
+                if on_done:
+                    on_done(item, error=e)
+                return None
+            self.count("succeeded")
+            recorder.increment("dispatch.succeeded", region=region)
+            if on_done:
+                on_done(item, error=None)
+            return result
+        finally:
+            self.pending.release()
+
+    def submit(self, region, fn, item, on_done=None):
+        # on_done(item, error) is called once the item finally succeeded, ran out of retries or was cancelled (DispatchCancelled)
+        self.pending.acquire()
+        return self.executor.submit(self.execute, region, fn, item, on_done)
+
+    def cancel(self):
+        # Calls in flight finish, every other submitted item is handed back to on_done with DispatchCancelled
+        self.cancelled.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait(self):
+        self.executor.shutdown(wait=True)
+        return self.get_stats()
+
+    def get_stats(self):
+        elapsed = time.monotonic() - self.started_at
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["elapsed_seconds"] = elapsed
+        stats["calls_per_second"] = stats["succeeded"] / elapsed if elapsed > 0 else 0.0
+        stats["concurrency_limit"] = self.concurrency_limit
+        with self.buckets_lock:
+            stats["region_rates"] = {region: bucket.rate for region, bucket in self.buckets.items()}
+        return stats
@@ -0,0 +1,69 @@
+import json
+from logger import configure_logger
+from config import LOGS_LEVEL, RESOURCE_TYPE_FILTERS
+
+logger = configure_logger(file_name="events.py", logs_level=LOGS_LEVEL)
+
+TAG_CHANGE_SOURCE = "aws.tag"
+TAG_CHANGE_DETAIL_TYPE = "Tag Change on Resource"
+
+
+def get_event_records(event):
+    # EventBridge invokes the lambda with one event, an SQS queue in between batches them as JSON message bodies
+    if isinstance(event, dict) and isinstance(event.get('Records'), list):
+        records = []
+        for record in event['Records']:
+            try:
+                records.append(json.loads(record['body']))
+            except Exception as e:
+                logger.error(f"Skipping unreadable SQS record {record.get('messageId')}: {e}")
+        return records
+    return [event]
+
+
+def is_tag_change_event(record):
+    return isinstance(record, dict) and record.get('source') == TAG_CHANGE_SOURCE and record.get('detail-type') == TAG_CHANGE_DETAIL_TYPE
+
+
+def matches_resource_type(resource_arn, resource_type_filter):
+    # "service" or "service:resource-type" against arn:partition:service:region:account:resource
+    service, _, resource_type = resource_type_filter.partition(':')
+    arn_parts = resource_arn.split(':', 5)
+    if len(arn_parts) != 6 or arn_parts[2] != service:
+        return False
+    return not resource_type or arn_parts[5].startswith(resource_type + '/') or arn_parts[5].startswith(resource_type + ':')
+
+
+def get_tag_change_resources(event, monitoring_tags_prefix, monitoring_tag_name, monitoring_tag_value, regions=None,
+                             resource_types=RESOURCE_TYPE_FILTERS):
+    # Returns the resources of the tag change events in the same shape as the pages of Resources.iter_resource_type_pages,
+    # or None when the event holds no tag change event at all and the full scan should run instead
+    records = [record for record in get_event_records(event) if is_tag_change_event(record)]
+    if not records:
+        return None
+
+    # Events of a batch can arrive out of order, the highest tag set version of a resource wins
+    latest_records = {}
+    for record in records:
+        detail = record.get('detail', {})
+        for resource_arn in record.get('resources', []):
+            latest_record = latest_records.get(resource_arn)
+            if latest_record is None or detail.get('version', 0) >= latest_record.get('detail', {}).get('version', 0):
+                latest_records[resource_arn] = record
+
+    resources = []
+    for resource_arn, record in latest_records.items():
+        # The event carries every tag of the resource after the change, no need to ask the tagging API
+        tags = record.get('detail', {}).get('tags', {})
+        # Our own tag flips to '2' or '3' trigger events too, they are dropped here
+        if tags.get(monitoring_tag_name) != monitoring_tag_value:
+            continue
+        if not any(matches_resource_type(resource_arn, resource_type) for resource_type in resource_types):
+            continue
+        region = resource_arn.split(':')[3] or record.get('region')
+        if regions and region not in regions:
+            continue
+        tags = {key: value for key, value in tags.items() if key.startswith(monitoring_tags_prefix)}
+        resources.append({'Region': region, 'ResourceARN': resource_arn, 'Tags': tags})
+    logger.debug("Tag change events: %d, resources to monitor: %d", len(records), len(resources))
+    return resources
@@ -0,0 +1,220 @@
+import copy
+import random
+import threading
+import time
+from events import matches_resource_type
+
+# Offline stand-in for the Resource Groups Tagging, CloudWatch and EC2 APIs used by the lambda.
+# Only the calls and response fields this code base relies on are implemented.
+
+SYNTHETIC_RESOURCE_TYPES = (
+    # (ARN template, namespace, metric tags)
+    ("arn:aws:ec2:{region}:123456789012:instance/i-{index:017x}", "AWS/EC2",
+     {"Enpass:Monitoring:Metric:CPUUtilization": "AVG:GTET:80:3",
+      "Enpass:Monitoring:CustomMetric:ElasticBeanstalk/CWAgent:mem_used_percent": "AVG:GTET:85:3"}),
+    ("arn:aws:rds:{region}:123456789012:db:database-{index}", "AWS/RDS",
+     {"Enpass:Monitoring:Metric:CPUUtilization": "AVG:GTET:75:5",
+      "Enpass:Monitoring:Metric:FreeStorageSpace": "MIN:LTET:10737418240:1",
+      "Enpass:Monitoring:Metric:DatabaseConnections": "MAX:GTT:500:3"}),
+    ("arn:aws:sqs:{region}:123456789012:queue-{index}", "AWS/SQS",
+     {"Enpass:Monitoring:Metric:ApproximateAgeOfOldestMessage": "MAX:GTT:600:2"}),
+    ("arn:aws:elasticache:{region}:123456789012:cluster:cache-{index}", "AWS/ElastiCache",
+     {"Enpass:Monitoring:Metric:EngineCPUUtilization": "AVG:GTET:90:3",
+      "Enpass:Monitoring:Metric:DatabaseMemoryUsagePercentage": "AVG:GTET:80:3"}),
+    ("arn:aws:elasticloadbalancing:{region}:123456789012:loadbalancer/app/alb-{index}/{index:016x}", "AWS/ApplicationELB",
+     {"Enpass:Monitoring:Metric:TargetResponseTime": "AVG:GTT:2:3",
+      "Enpass:Monitoring:Metric:HTTPCode_ELB_5XX_Count": "SUM:GTT:10:1"}),
+)
+
+THROTTLED_OPERATIONS = {
+    "put_metric_alarm": "Throttling",
+    "tag_resources": "ThrottlingException",
+    "get_resources": "ThrottlingException",
+    "describe_alarms": "Throttling",
+    "list_metrics": "Throttling",
+}
+
+
+class FakeClientError(Exception):
+    # Shaped like botocore's ClientError as far as error handling here is concerned
+    def __init__(self, code, operation_name):
+        self.response = {"Error": {"Code": code, "Message": "Rate exceeded"}}
+        self.operation_name = operation_name
+        super().__init__(f"An error occurred ({code}) when calling the {operation_name} operation: Rate exceeded")
+
+
+class FakeAWS:
+    def __init__(self, latency=0.0, throttle_probability=0.0, rate_limits=None, seed=0):
+        # latency: seconds added to every call; rate_limits: operation -> calls/sec per region before throttling
+        self.latency = latency
+        self.throttle_probability = throttle_probability
+        self.rate_limits = rate_limits or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.resources = {}
+        self.alarms = {}
+        self.metrics = {}
+        self.call_counts = {}
+        self.throttle_counts = {}
+        self.rate_windows = {}
+
+    def add_synthetic_fleet(self, size, regions, monitoring_tags_prefix="Enpass:Monitoring:", sns_topic_arn=None):
+        for index in range(size):
+            region = regions[index % len(regions)]
+            arn_template, namespace, metric_tags = SYNTHETIC_RESOURCE_TYPES[index % len(SYNTHETIC_RESOURCE_TYPES)]
+            tags = {
+                f"{monitoring_tags_prefix}Enabled": "1",
+                f"{monitoring_tags_prefix}Namespace": namespace,
+                f"{monitoring_tags_prefix}SNSTopicARN": sns_topic_arn or f"arn:aws:sns:{region}:123456789012:alarms",
+                "Name": f"resource-{index}",
+                "Environment": "benchmark",
+            }
+            tags.update(metric_tags)
+            self.resources.setdefault(region, {})[arn_template.format(region=region, index=index)] = tags
+
+    def reset_counters(self):
+        with self.lock:
+            self.call_counts.clear()
+            self.throttle_counts.clear()
+            self.rate_windows.clear()
+
+    def record_call(self, operation, region):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+            throttled = self.throttle_probability and self.random.random() < self.throttle_probability
+            rate_limit = self.rate_limits.get(operation)
+            if rate_limit and not throttled:
+                # One second fixed window per (operation, region)
+                window_key = (operation, region, int(time.monotonic()))
+                calls = self.rate_windows.get(window_key, 0) + 1
+                self.rate_windows[window_key] = calls
+                throttled = calls > rate_limit
+            if throttled:
+                self.throttle_counts[operation] = self.throttle_counts.get(operation, 0) + 1
+        if throttled:
+            raise FakeClientError(THROTTLED_OPERATIONS.get(operation, "Throttling"), operation)
+
+    def client(self, service_name, region):
+        clients = {
+            "resourcegroupstaggingapi": FakeTaggingClient,
+            "cloudwatch": FakeCloudWatchClient,
+            "ec2": FakeEC2Client,
+        }
+        return clients[service_name](self, region or "us-east-1")
+
+
+class FakePaginator:
+    def __init__(self, method, token_key):
+        self.method = method
+        self.token_key = token_key
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            token = page.get(self.token_key)
+            if not token:
+                return
+            kwargs[self.token_key] = token
+
+
+class FakeClient:
+    PAGINATION_TOKENS = {}
+
+    def __init__(self, aws, region):
+        self.aws = aws
+        self.region = region
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(getattr(self, operation_name), self.PAGINATION_TOKENS[operation_name])
+
+
+def get_page(items, token, page_size):
+    start = int(token or 0)
+    end = start + page_size
+    return items[start:end], (str(end) if end < len(items) else "")
+
+
+class FakeTaggingClient(FakeClient):
+    PAGINATION_TOKENS = {"get_resources": "PaginationToken"}
+
+    def get_resources(self, TagFilters=None, ResourceTypeFilters=None, ResourcesPerPage=100, PaginationToken=None, **kwargs):
+        self.aws.record_call("get_resources", self.region)
+        # The token is the position in the region's resources where the next page starts scanning
+        region_resources = list(self.aws.resources.get(self.region, {}).items())
+        position = int(PaginationToken or 0)
+        page = []
+        while position < len(region_resources) and len(page) < ResourcesPerPage:
+            resource_arn, tags = region_resources[position]
+            position += 1
+            if ResourceTypeFilters and not any(matches_resource_type(resource_arn, type_filter) for type_filter in ResourceTypeFilters):
+                continue
+            if all(tag_filter["Key"] in tags and ("Values" not in tag_filter or tags[tag_filter["Key"]] in tag_filter["Values"])
+                   for tag_filter in TagFilters or []):
+                page.append((resource_arn, tags))
+        return {
+            "ResourceTagMappingList": [{"ResourceARN": resource_arn, "Tags": [{"Key": key, "Value": value} for key, value in tags.items()]}
+                                       for resource_arn, tags in page],
+            "PaginationToken": str(position) if position < len(region_resources) else "",
+        }
+
+    def tag_resources(self, ResourceARNList, Tags):
+        self.aws.record_call("tag_resources", self.region)
+        failed_resources = {}
+        for resource_arn in ResourceARNList:
+            tags = self.aws.resources.get(self.region, {}).get(resource_arn)
+            if tags is None:
+                failed_resources[resource_arn] = {"StatusCode": 404, "ErrorCode": "InvalidParameterException", "ErrorMessage": "Resource not found"}
+            else:
+                tags.update(Tags)
+        return {"FailedResourcesMap": failed_resources}
+
+    def untag_resources(self, ResourceARNList, TagKeys):
+        self.aws.record_call("untag_resources", self.region)
+        for resource_arn in ResourceARNList:
+            for tag_key in TagKeys:
+                self.aws.resources.get(self.region, {}).get(resource_arn, {}).pop(tag_key, None)
+        return {"FailedResourcesMap": {}}
+
+
+class FakeCloudWatchClient(FakeClient):
+    PAGINATION_TOKENS = {"describe_alarms": "NextToken", "list_metrics": "NextToken"}
+
+    def put_metric_alarm(self, **kwargs):
+        self.aws.record_call("put_metric_alarm", self.region)
+        kwargs.pop("Tags", None)
+        with self.aws.lock:
+            self.aws.alarms.setdefault(self.region, {})[kwargs["AlarmName"]] = kwargs
+        return {}
+
+    def describe_alarms(self, AlarmNamePrefix="", AlarmNames=None, AlarmTypes=None, MaxRecords=100, NextToken=None):
+        self.aws.record_call("describe_alarms", self.region)
+        with self.aws.lock:
+            alarm_names = sorted(alarm_name for alarm_name in self.aws.alarms.get(self.region, {})
+                                 if alarm_name.startswith(AlarmNamePrefix or "") and (AlarmNames is None or alarm_name in AlarmNames))
+            page, token = get_page(alarm_names, NextToken, MaxRecords)
+            alarms = [copy.deepcopy(self.aws.alarms[self.region][alarm_name]) for alarm_name in page]
+        return {"MetricAlarms": alarms, "NextToken": token}
+
+    def delete_alarms(self, AlarmNames):
+        self.aws.record_call("delete_alarms", self.region)
+        with self.aws.lock:
+            for alarm_name in AlarmNames:
+                self.aws.alarms.get(self.region, {}).pop(alarm_name, None)
+        return {}
+
+    def list_metrics(self, Namespace=None, MetricName=None, NextToken=None, **kwargs):
+        self.aws.record_call("list_metrics", self.region)
+        metrics = [metric for metric in self.aws.metrics.get(self.region, [])
+                   if (Namespace is None or metric["Namespace"] == Namespace) and (MetricName is None or metric["MetricName"] == MetricName)]
+        page, token = get_page(metrics, NextToken, 500)
+        return {"Metrics": page, "NextToken": token}
+
+
+class FakeEC2Client(FakeClient):
+    def describe_regions(self, **kwargs):
+        self.aws.record_call("describe_regions", self.region)
+        regions = sorted(set(self.aws.resources) | set(self.aws.alarms) | {self.region})
+        return {"Regions": [{"RegionName": region} for region in regions]}
@@ -0,0 +1,17 @@
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode="w", opener=open, **kwargs):
+    # Written next to the target and renamed once complete, a reader or a crash never sees half a file.
+    # opener: open, gzip.open or anything with the same signature
+    temporary_path = f"{path}.tmp"
+    try:
+        with opener(temporary_path, mode, **kwargs) as output_file:
+            yield output_file
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
@@ -0,0 +1,72 @@
+import hashlib
+from abc import ABC, abstractmethod
+import json
+import time
+from logger import configure_logger
+from sqlite_store import SqliteStore
+from config import LOGS_LEVEL, FINGERPRINT_STORE_PATH, MONITORING_TAG_NAME
+
+logger = configure_logger(file_name="fingerprints.py", logs_level=LOGS_LEVEL)
+
+
+def get_tags_fingerprint(tags):
+    # Tags come back in any order, hash a canonical form. The Enabled tag is our own state, flipping it or setting it
+    # back to '1' does not change what the alarms should be.
+    canonical_tags = json.dumps(sorted((key, value) for key, value in tags.items() if key != MONITORING_TAG_NAME), separators=(',', ':'))
+    return hashlib.blake2b(canonical_tags.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class FingerprintStore(ABC):
+    # Maps ResourceARN -> fingerprint of its monitoring tags when its alarms were last set successfully
+
+    @abstractmethod
+    def get_fingerprints(self, resource_arns):
+        pass
+
+    @abstractmethod
+    def put_fingerprints(self, fingerprints):
+        pass
+
+    @abstractmethod
+    def delete_fingerprints(self, resource_arns):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteFingerprintStore(SqliteStore, FingerprintStore):
+    def __init__(self, path=FINGERPRINT_STORE_PATH):
+        super().__init__(path, schema=(
+            "CREATE TABLE IF NOT EXISTS fingerprints (resource_arn TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, updated_at REAL NOT NULL)",
+        ))
+
+    def get_fingerprints(self, resource_arns):
+        try:
+            return dict(self.select_in("SELECT resource_arn, fingerprint FROM fingerprints WHERE resource_arn IN ({placeholders})", resource_arns))
+        except Exception as e:
+            # An unreadable store only costs a full reprocessing
+            logger.error(f"Error reading fingerprints: {e}")
+            return {}
+
+    def put_fingerprints(self, fingerprints):
+        try:
+            updated_at = time.time()
+            with self.lock, self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO fingerprints (resource_arn, fingerprint, updated_at) VALUES (?, ?, ?)",
+                    [(resource_arn, fingerprint, updated_at) for resource_arn, fingerprint in fingerprints.items()]
+                )
+            return True
+        except Exception as e:
+            logger.error(f"Error writing fingerprints: {e}")
+            return False
+
+    def delete_fingerprints(self, resource_arns):
+        try:
+            with self.lock, self.connection:
+                self.connection.executemany("DELETE FROM fingerprints WHERE resource_arn = ?", [(resource_arn,) for resource_arn in resource_arns])
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting fingerprints: {e}")
+            return False
@@ -1,21 +1,148 @@
+import atexit
+import itertools
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+from config import LOGS_FORMAT, LOGS_DEBUG_SAMPLING
 
-def configure_logger(file_name, logs_level):
+# Every module logger is a child of this one, it alone has a handler
+LOGGER_NAMESPACE = "automated_cloudwatch_alarms"
+# Fields added with extra={...} or from the log context that go into the JSON records
+CONTEXT_FIELDS = ("run_id", "request_id", "region", "resource_arn", "alarm_name", "stage")
+
+# Set by the handler for the invocation, added to every record by the queue handler
+log_context = {}
+
+setup_lock = threading.Lock()
+log_queue = None
+log_listener = None
+# Arguments of the first setup_logging call, a forked child sets up its own backend with them
+log_settings = None
+
+
+def get_logger_name(record):
+    # The module file name, e.g. "main.py", without the namespace
+    prefix = f"{LOGGER_NAMESPACE}."
+    return record.name[len(prefix):] if record.name.startswith(prefix) else record.name
+
+
+class ContextFilter(logging.Filter):
+    # Runs on the calling thread: adds the invocation context and drops the sampled out DEBUG records of busy stages
+    def __init__(self, sampling=None):
+        super().__init__()
+        self.sampling = dict(sampling or {})
+        self.counters = {stage: itertools.count() for stage in self.sampling}
+
+    def filter(self, record):
+        if record.levelno == logging.DEBUG:
+            stage = getattr(record, "stage", None)
+            sample_rate = self.sampling.get(stage)
+            if sample_rate and sample_rate > 1:
+                # next() on itertools.count is atomic under the GIL
+                if next(self.counters[stage]) % sample_rate:
+                    return False
+                record.sample_rate = sample_rate
+        for key, value in log_context.items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler.prepare formats the message on the calling thread, here msg % args is left to the listener thread.
+    # Arguments are queued as they are, do not log an object that is changed right after.
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        log_record = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": get_logger_name(record),
+            "function": record.funcName,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                log_record[field] = value
+        if getattr(record, "sample_rate", None):
+            log_record["sample_rate"] = record.sample_rate
+        if record.exc_info:
+            log_record["exception"] = self.formatException(record.exc_info)
+        return json.dumps(log_record, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(logger_name)s - %(levelname)s - %(funcName)s - %(message)s')
+
+    def format(self, record):
+        record.logger_name = get_logger_name(record)
+        return super().format(record)
+
+
+def setup_logging(logs_level, logs_format=LOGS_FORMAT, debug_sampling=LOGS_DEBUG_SAMPLING):
+    # Configures the queue backend once per process, later calls only return
+    global log_queue, log_listener, log_settings
     log_level = getattr(logging, logs_level.upper(), None)
     if not isinstance(log_level, int):
         raise ValueError(f"Invalid logging level: {logs_level}")
 
-    logger = logging.getLogger(file_name)
-    logger.setLevel(log_level)
-    
-    # Remove any existing handlers to avoid duplicate logging
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-    
-    # formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s')
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+    with setup_lock:
+        if log_listener is not None:
+            return
+        log_settings = (logs_level, logs_format, debug_sampling)
+        root_logger = logging.getLogger(LOGGER_NAMESPACE)
+        root_logger.setLevel(log_level)
+        # Lambda attaches its own handler to the root logger, records must not reach it a second time
+        root_logger.propagate = False
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(JsonFormatter() if logs_format == "json" else TextFormatter())
+        # Unbounded, logging never blocks a worker thread; only the listener thread writes to the stream
+        log_queue = queue.Queue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter(debug_sampling))
+        root_logger.addHandler(queue_handler)
+        log_listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+
+
+def restart_logging_after_fork():
+    # A forked child inherits the queue but not the listener thread, records would pile up unwritten
+    global setup_lock, log_queue, log_listener
+    if log_settings is None:
+        return
+    setup_lock = threading.Lock()
+    log_queue = log_listener = None
+    setup_logging(*log_settings)
+
+
+os.register_at_fork(after_in_child=restart_logging_after_fork)
+
+
+def flush_logs():
+    # Waits until the listener wrote every queued record, Lambda freezes the container as soon as the handler returns
+    if log_queue is not None:
+        log_queue.join()
+
+
+def set_log_context(**fields):
+    # Replaces the context of the previous invocation, None values are dropped
+    log_context.clear()
+    log_context.update({key: value for key, value in fields.items() if value is not None})
+
+
+def configure_logger(file_name, logs_level):
+    setup_logging(logs_level)
+    # No handler or level of its own, records go up to the namespace logger
+    return logging.getLogger(f"{LOGGER_NAMESPACE}.{file_name}")
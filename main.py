@@ -1,108 +1,242 @@
+import argparse
 import concurrent.futures
+import multiprocessing
 import time
-from logger import configure_logger
-from resources import Resources
-from utility import AlarmUtility
-from alarms import Alarm
-from config import *
+from logger import configure_logger, set_log_context, flush_logs
+from resources import Resources, get_enabled_regions
+from reconcile import AlarmReconciler
+from pipeline import AlarmPipeline, TagChangePipeline, PlanPipeline, ApplyPipeline, MergePipeline
+from plans import PLAN_MODE, APPLY_MODE, get_plan_request, load_plan_summary
+from shards import ShardResultStore, MERGED_DISPATCH_STATS, get_resource_shard, get_shard_request, get_merge_request
+from events import get_tag_change_resources
+from fingerprints import SqliteFingerprintStore
+from metrics import recorder
+from run_context import RunContext
+from checkpoints import Deadline, FileCheckpointStore
+from retry_journal import SqliteRetryJournal
+from config import SETTINGS
 
-logger = configure_logger(file_name="main.py", logs_level=LOGS_LEVEL)
+logger = configure_logger(file_name="main.py", logs_level=SETTINGS.logs_level)
 
-def process_region(region):
+def get_tagged_resource_identifiers(region):
     try:
-        logger.debug(f"Fetching Resources for Region: {region}")
+        # Every resource still carrying the monitoring tag, whatever its state value
         resource = Resources()
-        resources_data = resource.get_resources(region=region, tag_name=MONITORING_TAG_NAME, tag_value=MONITORING_TAG_VALUE, monitoring_tags_prefix=MONITORING_TAGS_PREFIX)
-        return resources_data
+        resources_data = resource.get_resources(region=region, tag_name=SETTINGS.monitoring_tag_name, raise_on_error=True)
+        return {item['ResourceARN'].split(':')[-1] for item in resources_data}
     except Exception as e:
-        logger.error(f"Error fetching resources for region {region}: {str(e)}")
+        logger.error(f"Error fetching tagged resources for region {region}: {str(e)}")
+        return None
+
+def delete_orphaned_alarms(pipeline, regions, reconciler):
+    # Returns the orphaned alarms, deleted unless the tagged resources of a region could not be listed
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        identifier_sets = list(executor.map(get_tagged_resource_identifiers, regions))
+    # Never delete anything if we could not get a complete view of the tagged resources
+    if any(identifier_set is None for identifier_set in identifier_sets):
         return []
-    
-# Define a function to validate alarm data
-def validate_alarm(alarm_data):
-    alarm_utility = AlarmUtility()
+    orphaned_alarms = pipeline.get_orphaned_alarms(set().union(*identifier_sets))
+    if orphaned_alarms:
+        logger.info("Deleting Orphaned Alarms")
+        reconciler.delete_alarms(orphaned_alarms)
+        logger.info("Done Deleting Orphaned Alarms")
+    return orphaned_alarms
 
-    if alarm_utility.validate_alarm_data(alarm_data=alarm_data):
-        valid_alarms_data.append(alarm_data)
-    else:
-        FAILED_TO_CREATE_ALARM_RESOURCE_LIST.add(alarm_data["ResourceARN"])
+def settle_alarm_failures(retry_journal, run_context):
+    # Returns the (successful, failed, retrying) resources of the run.
+    # Without a journal every failed alarm fails its resource, with one only invalid alarms and alarms out of attempts do.
+    if retry_journal is None:
+        return run_context.get_successful_resources(), run_context.get_failed_resources(), set()
+
+    invalid_resources = run_context.get_invalid_resources()
+    failed_alarms = [(alarm_data, error) for alarm_data, error in run_context.get_failed_alarms() if alarm_data.resource_arn not in invalid_resources]
+    exhausted_resources = retry_journal.record_failures(failed_alarms, run_context.resource_fingerprints)
+    failed_resources = invalid_resources | exhausted_resources
+    retrying_resources = {alarm_data.resource_arn for alarm_data, _ in failed_alarms} - failed_resources
+    retry_journal.delete_resources(failed_resources)
+    retry_journal.delete_alarms(run_context.get_succeeded_alarm_keys())
+
+    # A resource is only done once none of its alarms waits in the journal, not due ones included
+    successful_resources = run_context.get_successful_resources()
+    successful_resources -= retry_journal.get_journaled_resources(successful_resources)
+    return successful_resources, failed_resources, retrying_resources
 
 def lambda_handler(event, context):
+    # Everything collected during this invocation, released when it ends so warm containers start clean
+    run_context = RunContext(deadline=Deadline(context, SETTINGS.deadline_safety_margin_ms))
+    # Every record of the invocation carries its run id, the request id ties it to the Lambda logs
+    set_log_context(run_id=run_context.run_id, request_id=getattr(context, "aws_request_id", None))
+    # Closed whatever the outcome, a failed run must not leave its connection open in a warm container
+    fingerprint_store = retry_journal = None
     try:
         logger.info("Lambda function execution started.")
 
         start_time = time.time()
+        recorder.reset()
 
         # Create an instance of the classes
         resource = Resources()
-        alarm_utility = AlarmUtility()
-        alarm = Alarm()
-
-        
-       # Fetch resources for each region in parallel
-        logger.info("Fetching Resources Data") 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            results = executor.map(process_region, regions)
-
-        # Flatten the list of lists
-        resources_data = [item for sublist in results for item in sublist if item]
-        logger.info("Resources data fetched successfully")
-
-        logger.debug("Resources Fetched:")
-        logger.debug(resources_data)
-        logger.debug(" ")
-        
-        logger.info("Processing Resources Data") 
-        alarms_data = alarm_utility.process_data(resources_data)
-        logger.info("Done Processing Resources Data") 
-
-        logger.debug("Processed alarms data:")
-        logger.debug(alarms_data)
-        logger.debug(" ")
-
-        if alarms_data:
-            logger.info("Validating Alarms Data")
-            # Submit validation tasks to ThreadPoolExecutor
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                validation_futures = [executor.submit(validate_alarm, alarm_data) for alarm_data in alarms_data]
-            logger.info("Done Validating Alarms Data")
-
-            logger.info("Setting Alarms on Resources")
-            with concurrent.futures.ThreadPoolExecutor(max_workers=SET_ALARMS_WORKER) as executor:
-                for alarm_data in valid_alarms_data:
-                    executor.submit(alarm.set_alarm, alarm_config=alarm_data)
-            logger.info("Done Setting Alarms on Resources")
-
-            NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST = alarm_utility.remove_failed_resources(successful_resources=SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST, 
-                                                                                                failed_resources=FAILED_TO_CREATE_ALARM_RESOURCE_LIST)
-            
-            if NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST:
-                resource.modify_tag_value(resources_arns=NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST, tag_key=MONITORING_TAG_NAME, new_value=SUCCESSFULL_MONITORING_TAG_VALUE)
-                logger.info("Updated 'Enpass:Monitoring:Enabled' Tag value from '1' --> '2' for successful resources")
+        reconciler = AlarmReconciler()
+
+        fingerprint_store = SqliteFingerprintStore(SETTINGS.fingerprint_store_path) if SETTINGS.incremental_discovery else None
+        retry_journal = SqliteRetryJournal(SETTINGS.retry_journal_path) if SETTINGS.retry_journal_enabled else None
+        # {"mode": "plan"} and {"mode": "apply"} split discovery from the writes, tag change events only touch the resources
+        # they name, any other event runs the full scan
+        plan_request = get_plan_request(event)
+        plan_mode, plan_path = plan_request if plan_request is not None else (None, SETTINGS.plan_path)
+        # {"shard_index": i, "shard_count": n} runs one shard of a full scan or an apply, {"mode": "merge"} combines the shards
+        shard_request = get_shard_request(event)
+        merge_shard_count = get_merge_request(event)
+        if shard_request is not None and plan_mode == PLAN_MODE:
+            raise ValueError("A plan is written by a single invocation, shard its apply instead")
+        shard_store = ShardResultStore() if shard_request is not None or merge_shard_count is not None else None
+        # Shards would share the checkpoint path, a shard stopped at its deadline is run again from the start
+        checkpoint_store = FileCheckpointStore() if SETTINGS.checkpoints_enabled and shard_request is None else None
+        tag_change_resources = None
+        if plan_request is None and merge_shard_count is None:
+            tag_change_resources = get_tag_change_resources(event, SETTINGS.monitoring_tags_prefix, SETTINGS.monitoring_tag_name,
+                                                             SETTINGS.monitoring_tag_value, regions=SETTINGS.regions)
+        # Only a full scan sees every tagged resource, it alone deletes orphans and resumes from checkpoints.
+        # The shards of a full scan leave orphans to their merge.
+        full_scan = plan_request is None and merge_shard_count is None and tag_change_resources is None
+        delete_orphans = full_scan and shard_request is None
+        if merge_shard_count is not None:
+            # Raises unless every shard saved its results
+            shard_results = shard_store.load_all(merge_shard_count)
+            logger.info(f"Merging the Results of {merge_shard_count} Shards")
+            regions = sorted({region for results in shard_results for region in results["regions"]})
+            delete_orphans = all(results["full_scan"] for results in shard_results)
+            pipeline = MergePipeline(shard_results, regions=regions, run_context=run_context)
+        elif plan_mode == PLAN_MODE:
+            logger.info(f"Fetching Resources and Writing the Alarm Plan to {plan_path}")
+            regions = SETTINGS.regions or get_enabled_regions()
+            pipeline = PlanPipeline(plan_path, regions=regions, run_context=run_context, fingerprint_store=fingerprint_store)
+        elif plan_mode == APPLY_MODE:
+            # Raises when there is no complete plan to apply
+            plan_summary = load_plan_summary(plan_path)
+            logger.info(f"Setting Alarms on {plan_summary['planned_resources']} Resources from the Plan of run {plan_summary['run_id']}")
+            regions = plan_summary["regions"]
+            pipeline = ApplyPipeline(plan_path, regions=regions, run_context=run_context, shard=shard_request)
+        elif tag_change_resources is not None:
+            logger.info(f"Setting Alarms on {len(tag_change_resources)} Resources from Tag Change Events")
+            regions = sorted({item['Region'] for item in tag_change_resources})
+            if retry_journal is not None:
+                # All their alarms are put again, journaled ones included
+                retry_journal.delete_resources(item['ResourceARN'] for item in tag_change_resources)
+            pipeline = TagChangePipeline(tag_change_resources, regions=regions, run_context=run_context)
+        else:
+            # Stream resources from discovery through parsing and validation into alarm creation
+            logger.info("Fetching Resources and Setting Alarms on Resources")
+            regions = SETTINGS.regions or get_enabled_regions()
+            checkpoint = checkpoint_store.load() if checkpoint_store is not None else None
+            retry_alarms = []
+            if checkpoint is not None and checkpoint["regions"] == list(regions):
+                # A previous invocation stopped at its deadline, carry on from where it was
+                logger.info(f"Resuming from the checkpoint of run {checkpoint['run_id']}: {len(checkpoint['pending_alarms'])} pending alarms")
+                run_context.restore_checkpoint(checkpoint)
+            elif retry_journal is not None:
+                # Failed alarms due for another attempt, set once discovery finds their resource unchanged
+                retry_alarms = retry_journal.get_due_alarms()
+                if shard_request is not None:
+                    shard_index, shard_count = shard_request
+                    retry_alarms = [alarm_data for alarm_data in retry_alarms
+                                    if get_resource_shard(alarm_data.resource_arn, shard_count, regions) == shard_index]
+            pipeline = AlarmPipeline(regions=regions, run_context=run_context, fingerprint_store=fingerprint_store, retry_journal=retry_journal,
+                                     shard=shard_request, retry_alarms=retry_alarms)
+        pipeline_stats = pipeline.run()
+        dispatch_stats = pipeline_stats["dispatch"]
+        logger.info("Done Setting Alarms on Resources")
+        logger.info(f"RESOURCES: {pipeline_stats['resources']} | UNCHANGED RESOURCES: {pipeline_stats['skipped']} | RETRYING RESOURCES: {pipeline_stats['retrying']} | ALARMS: {pipeline_stats['alarms']} | RETRIED ALARMS: {pipeline_stats['retried']} | INVALID: {pipeline_stats['invalid']}")
+        logger.info(f"PUT CALLS: {dispatch_stats['calls']} | RETRIES: {dispatch_stats['retries']} | THROTTLES: {dispatch_stats['throttles']} | CALLS/SEC: {dispatch_stats['calls_per_second']:.2f}")
+
+        if plan_mode == PLAN_MODE:
+            plan_summary = pipeline_stats["summary"]
+            logger.info(f"PLAN: {plan_path} | COMPLETE: {plan_summary['complete']} | RESOURCES: {plan_summary['planned_resources']} | ALARMS: {plan_summary['planned_alarms']} | CREATE: {plan_summary['actions']['create']} | UPDATE: {plan_summary['actions']['update']} | UNCHANGED: {plan_summary['actions']['unchanged']} | INVALID: {plan_summary['invalid']}")
+        elif shard_request is not None:
+            # Tags are flipped by the merge once every shard saved its results, a stopped shard is not merged
+            shard_index, shard_count = shard_request
+            shard_results = run_context.get_checkpoint(regions)
+            shard_results.update(complete=not run_context.is_stopped(), full_scan=full_scan,
+                                 dispatch={stat: dispatch_stats[stat] for stat in MERGED_DISPATCH_STATS},
+                                 desired_alarm_names={region: sorted(alarm_names) for region, alarm_names in pipeline.desired_alarm_names.items()})
+            shard_store.save(shard_index, shard_count, shard_results)
+            logger.info(f"SHARD: {shard_index} of {shard_count} | COMPLETE: {shard_results['complete']} | RESULTS: {shard_store.get_result_path(shard_index, shard_count)}")
+        elif run_context.is_stopped():
+            # Nothing is flipped yet, resources with alarms still pending would be tagged as done
+            if plan_mode == APPLY_MODE:
+                logger.warning("Stopped at the deadline, apply the plan again to set the remaining alarms")
+            elif checkpoint_store is not None:
+                checkpoint = run_context.get_checkpoint(regions)
+                checkpoint_store.save(checkpoint)
+                logger.info(f"Checkpoint saved with {len(checkpoint['pending_alarms'])} pending alarms, the next invocation resumes from it")
+            else:
+                logger.warning("Stopped at the deadline without a checkpoint, the next run starts over")
+        else:
+            orphaned_alarms = []
+            # Orphans need the complete view of a full scan, and are looked for whether or not this run had alarms to set
+            if SETTINGS.delete_orphaned_alarms and delete_orphans:
+                orphaned_alarms = delete_orphaned_alarms(pipeline, regions, reconciler)
+
+            logger.info(f"CREATE: {pipeline_stats['create']} | UPDATE: {pipeline_stats['update']} | UNCHANGED: {pipeline_stats['unchanged']} | DELETE: {len(orphaned_alarms)}")
+
+            if pipeline_stats["alarms"] or pipeline_stats["retried"]:
+                # Resources retrying failed alarms keep the value '1' and are left to the retry journal
+                NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST, FAILED_TO_CREATE_ALARM_RESOURCE_LIST, RETRYING_RESOURCE_LIST = settle_alarm_failures(retry_journal, run_context)
 
+                # Resources whose tag could not be flipped keep the value '1' and are processed again by the next run
+                tag_start_time = time.perf_counter()
+                FAILED_TO_TAG_RESOURCE_LIST = {}
+                if NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST:
+                    FAILED_TO_TAG_RESOURCE_LIST.update(resource.modify_tag_value(resources_arns=NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST, tag_key=SETTINGS.monitoring_tag_name, new_value=SETTINGS.successfull_monitoring_tag_value))
+                    logger.info("Updated 'Enpass:Monitoring:Enabled' Tag value from '1' --> '2' for successful resources")
+
+                # Independent of the successful ones, a run where every resource failed still tags them '3'
                 if FAILED_TO_CREATE_ALARM_RESOURCE_LIST:
-                    resource.modify_tag_value(resources_arns=FAILED_TO_CREATE_ALARM_RESOURCE_LIST, tag_key=MONITORING_TAG_NAME, new_value=FAILED_MONITORING_TAG_VALUE)
+                    FAILED_TO_TAG_RESOURCE_LIST.update(resource.modify_tag_value(resources_arns=FAILED_TO_CREATE_ALARM_RESOURCE_LIST, tag_key=SETTINGS.monitoring_tag_name, new_value=SETTINGS.failed_monitoring_tag_value))
                     logger.info("Updated 'Enpass:Monitoring:Enabled' Tag value from '1' --> '3' for failed resources")
+                recorder.record_stage("modify_tag_value", time.perf_counter() - tag_start_time,
+                                      items=len(NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST) + len(FAILED_TO_CREATE_ALARM_RESOURCE_LIST))
 
-            # Calculate resource counts
-            total_resources = len(NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST) + len(FAILED_TO_CREATE_ALARM_RESOURCE_LIST)
-            total_successful_resources = len(NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST)
-            total_failed_resources = len(FAILED_TO_CREATE_ALARM_RESOURCE_LIST)
-
-            # Log lists of successful and failed resources
-            logger.debug("Successful resources list:")
-            logger.debug(NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST)
-            logger.debug("Failed resources list:")
-            logger.debug(FAILED_TO_CREATE_ALARM_RESOURCE_LIST)
-            logger.info(f"TOTAL: {total_resources} | SUCCESS: {total_successful_resources} | FALIED: {total_failed_resources}")
-        else:
-            logger.info("No Alarms Found to Set")
+                if fingerprint_store is not None:
+                    # Next runs skip the successful resources until their monitoring tags change, once they are tagged '2'
+                    fingerprint_store.put_fingerprints({resource_arn: run_context.resource_fingerprints[resource_arn]
+                                                        for resource_arn in NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST
+                                                        if resource_arn in run_context.resource_fingerprints and resource_arn not in FAILED_TO_TAG_RESOURCE_LIST})
+                    fingerprint_store.delete_fingerprints(FAILED_TO_CREATE_ALARM_RESOURCE_LIST | RETRYING_RESOURCE_LIST)
+
+                # Calculate resource counts
+                total_resources = len(NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST) + len(FAILED_TO_CREATE_ALARM_RESOURCE_LIST)
+                total_successful_resources = len(NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST)
+                total_failed_resources = len(FAILED_TO_CREATE_ALARM_RESOURCE_LIST)
+
+                # Log lists of successful and failed resources
+                logger.debug("Successful resources list: %s", NEW_SUCCESSFULL_TO_CREATE_ALARM_RESOURCE_LIST)
+                logger.debug("Failed resources list: %s", FAILED_TO_CREATE_ALARM_RESOURCE_LIST)
+                logger.debug("Retrying resources list: %s", RETRYING_RESOURCE_LIST)
+                logger.debug("Failed to tag resources list: %s", FAILED_TO_TAG_RESOURCE_LIST)
+                logger.info(f"TOTAL: {total_resources} | SUCCESS: {total_successful_resources} | FALIED: {total_failed_resources} | RETRYING: {len(RETRYING_RESOURCE_LIST)} | TAG FAILED: {len(FAILED_TO_TAG_RESOURCE_LIST)}")
+            else:
+                logger.info("No Alarms Found to Set")
+
+        if merge_shard_count is not None:
+            # Merged once, the next sharded run saves new results
+            shard_store.clear(merge_shard_count)
+        if checkpoint_store is not None and full_scan and not run_context.is_stopped():
+            # The scan is complete, the next one starts from the beginning
+            checkpoint_store.clear()
 
         end_time = time.time()
         execution_time = end_time - start_time
         logger.info("Execution Completed")
         logger.info(f"Total Execution Time: {execution_time} seconds")
 
+        if SETTINGS.emit_metrics:
+            recorder.record_stage("total", execution_time, items=pipeline_stats["resources"])
+            recorder.emit(properties={"Resources": pipeline_stats["resources"], "Alarms": pipeline_stats["alarms"],
+                                      "Created": pipeline_stats["create"], "Updated": pipeline_stats["update"],
+                                      "Unchanged": pipeline_stats["unchanged"], "Invalid": pipeline_stats["invalid"],
+                                      "Stopped": run_context.is_stopped()})
+
         return {
             'statusCode': 200,
             'body': 'Program Executed'
@@ -113,6 +247,39 @@ def lambda_handler(event, context):
             'statusCode': 500,
             'body': 'An error occurred during execution.'
         }
+    finally:
+        if fingerprint_store is not None:
+            fingerprint_store.close()
+        if retry_journal is not None:
+            retry_journal.close()
+        run_context.release()
+        # Queued records are written before Lambda freezes the container
+        flush_logs()
+
+def run_shard(event):
+    # Runs in a child process of run_local_shards, one shard like one invocation would
+    return lambda_handler(event, context=None)
 
-# Invoke the lambda_handler function
-lambda_handler(event=0, context=0)
\ No newline at end of file
+def run_local_shards(event, shard_count, mp_context=None):
+    # Local sharded run: every shard in its own process, no GIL in common, then the merge in this one.
+    # Lambda has no /dev/shm for a process pool, there the shards are parallel invocations followed by a merge invocation.
+    shard_events = [dict(event, shard_index=shard_index, shard_count=shard_count) for shard_index in range(shard_count)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=shard_count, mp_context=mp_context or multiprocessing.get_context("spawn")) as executor:
+        responses = list(executor.map(run_shard, shard_events))
+    for shard_index, response in enumerate(responses):
+        if response['statusCode'] != 200:
+            logger.error(f"Shard {shard_index} of {shard_count} failed, the merge stops on its missing results")
+    return lambda_handler({"mode": "merge", "shard_count": shard_count}, context=None)
+
+if __name__ == "__main__":
+    # Local run, Lambda only imports the module and calls lambda_handler
+    parser = argparse.ArgumentParser(description="Set the alarms of the tagged resources")
+    parser.add_argument("--mode", choices=["plan", "apply"], help="Write a plan or apply one instead of the full run")
+    parser.add_argument("--plan-path", help="Plan file of --mode plan and apply")
+    parser.add_argument("--shards", type=int, default=1, help="Shard the full run or the apply across this many processes")
+    args = parser.parse_args()
+    local_event = {key: value for key, value in (("mode", args.mode), ("plan_path", args.plan_path)) if value is not None}
+    if args.shards > 1:
+        run_local_shards(local_event, args.shards)
+    else:
+        lambda_handler(event=local_event, context=None)
@@ -0,0 +1,95 @@
+import threading
+import time
+from clients import get_client
+from logger import configure_logger
+from metrics import recorder
+from config import LOGS_LEVEL, METRIC_INDEX_TTL, METRIC_INDEX_FAILURE_TTL
+
+logger = configure_logger(file_name="metric_index.py", logs_level=LOGS_LEVEL)
+
+
+class MetricIndex:
+    # Every metric list_metrics reports for one (region, namespace), for O(1) existence checks
+    def __init__(self, region, namespace, metrics):
+        self.region = region
+        self.namespace = namespace
+        self.loaded_at = time.monotonic()
+        self.metric_names = set()
+        self.metric_dimensions = set()
+        for metric in metrics:
+            self.metric_names.add(metric['MetricName'])
+            self.metric_dimensions.add(MetricIndex.get_metric_key(metric['MetricName'], ((dimension['Name'], dimension['Value']) for dimension in metric.get('Dimensions', []))))
+
+    @staticmethod
+    def get_metric_key(metric_name, dimensions):
+        return metric_name, frozenset(dimensions)
+
+    def has_metric(self, metric_name, dimensions=None):
+        # dimensions: (name, value) pairs that must match the metric's dimensions exactly, None to only check the name
+        if dimensions is None:
+            return metric_name in self.metric_names
+        return MetricIndex.get_metric_key(metric_name, dimensions) in self.metric_dimensions
+
+    def is_expired(self, ttl=METRIC_INDEX_TTL):
+        return time.monotonic() - self.loaded_at > ttl
+
+
+# Module scope so warm invocations reuse the indexes until they expire
+_indexes = {}
+_indexes_lock = threading.Lock()
+_loading_locks = {}
+# (region, namespace) -> time.monotonic() of the last failed load, the scan is not tried again until it is older than the failure TTL
+_failed_loads = {}
+
+
+def load_metric_index(region, namespace):
+    metrics = []
+    paginator = get_client('cloudwatch', region).get_paginator('list_metrics')
+    for page in paginator.paginate(Namespace=namespace):
+        recorder.increment("list_metrics.calls", region=region)
+        metrics.extend(page['Metrics'])
+    logger.debug("Loaded %d metrics of %s", len(metrics), namespace, extra={"region": region})
+    return MetricIndex(region, namespace, metrics)
+
+
+def has_recent_failure(key, failure_ttl):
+    failed_at = _failed_loads.get(key)
+    return failed_at is not None and time.monotonic() - failed_at <= failure_ttl
+
+
+def get_metric_index(region, namespace, ttl=METRIC_INDEX_TTL, failure_ttl=METRIC_INDEX_FAILURE_TTL):
+    # Returns None when the index can not be loaded
+    key = (region, namespace)
+    metric_index = _indexes.get(key)
+    if metric_index is not None and not metric_index.is_expired(ttl):
+        return metric_index
+    if has_recent_failure(key, failure_ttl):
+        return None
+
+    with _indexes_lock:
+        loading_lock = _loading_locks.setdefault(key, threading.Lock())
+
+    # One list_metrics scan per key, concurrent callers wait for it instead of starting their own
+    with loading_lock:
+        metric_index = _indexes.get(key)
+        if metric_index is not None and not metric_index.is_expired(ttl):
+            return metric_index
+        # Callers that waited for a scan that just failed do not run it again
+        if has_recent_failure(key, failure_ttl):
+            return None
+        try:
+            metric_index = load_metric_index(region, namespace)
+        except Exception as e:
+            logger.error(f"Error loading metric index for {namespace} in {region}: {e}")
+            _failed_loads[key] = time.monotonic()
+            return None
+        _failed_loads.pop(key, None)
+        _indexes[key] = metric_index
+        return metric_index
+
+
+def clear_metric_indexes():
+    # Forgets every loaded index and failed load, the next lookup of each key scans list_metrics again
+    with _indexes_lock:
+        _indexes.clear()
+        _failed_loads.clear()
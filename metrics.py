@@ -0,0 +1,162 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from config import METRICS_NAMESPACE, METRICS_SERVICE_NAME
+
+# Latency histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, float("inf"))
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, latency_ms):
+        for index, upper_bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= upper_bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def get_percentile(self, percentile):
+        # Upper bound of the bucket holding the percentile, capped by the largest value seen
+        rank = self.count * percentile / 100
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(LATENCY_BUCKETS_MS[index], self.max_ms)
+        return self.max_ms
+
+    def summarize(self):
+        summary = {"count": self.count, "avg": self.total_ms / self.count if self.count else 0.0, "max": self.max_ms}
+        for percentile in LATENCY_PERCENTILES:
+            summary[f"p{percentile}"] = self.get_percentile(percentile)
+        summary["buckets"] = {str(upper_bound): bucket_count for upper_bound, bucket_count in zip(LATENCY_BUCKETS_MS, self.counts) if bucket_count}
+        return summary
+
+
+class MetricsRecorder:
+    # Collects call counts, latencies and stage throughput of one invocation, emitted as one EMF document per region
+
+    def __init__(self, namespace=METRICS_NAMESPACE):
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+            self.started_at = time.time()
+
+    def increment(self, name, value=1, region=None):
+        with self.lock:
+            key = (name, region)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_latency(self, name, seconds, region=None):
+        with self.lock:
+            key = (name, region)
+            if key not in self.histograms:
+                self.histograms[key] = LatencyHistogram()
+            self.histograms[key].add(seconds * 1000)
+
+    @contextmanager
+    def time_call(self, name, region=None):
+        # Counts the call and its latency, and errors separately
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.increment(f"{name}.errors", region=region)
+            raise
+        finally:
+            self.increment(f"{name}.calls", region=region)
+            self.record_latency(f"{name}.latency", time.perf_counter() - start_time, region=region)
+
+    def record_stage(self, stage, seconds, items=0, region=None):
+        with self.lock:
+            key = (stage, region)
+            stage_stats = self.stages.setdefault(key, {"seconds": 0.0, "items": 0})
+            stage_stats["seconds"] += seconds
+            stage_stats["items"] += items
+
+    @staticmethod
+    def get_dimensions(region):
+        # Regional metrics carry the region as a dimension, the others only the service
+        return ["Service", "Region"] if region else ["Service"]
+
+    def to_emf(self, properties=None):
+        # One document per region, an EMF document has one value per dimension.
+        # The document without a region is always emitted and carries the properties of the run.
+        documents = {None: {}}
+
+        def add_metric(region, name, value, unit):
+            document = documents.setdefault(region, {})
+            document.setdefault("metrics", []).append({"Name": name, "Unit": unit})
+            document.setdefault("values", {})[name] = value
+
+        def sort_key(item):
+            return item[0][0], item[0][1] or ""
+
+        with self.lock:
+            for (name, region), value in sorted(self.counters.items(), key=sort_key):
+                add_metric(region, name, value, "Count")
+
+            for (name, region), histogram in sorted(self.histograms.items(), key=sort_key):
+                summary = histogram.summarize()
+                for percentile in LATENCY_PERCENTILES:
+                    add_metric(region, f"{name}.p{percentile}", summary[f"p{percentile}"], "Milliseconds")
+                add_metric(region, f"{name}.max", summary["max"], "Milliseconds")
+                documents[region].setdefault("histograms", {})[name] = summary
+
+            for (stage, region), stage_stats in sorted(self.stages.items(), key=sort_key):
+                items_per_second = stage_stats["items"] / stage_stats["seconds"] if stage_stats["seconds"] else 0.0
+                add_metric(region, f"{stage}.duration", stage_stats["seconds"] * 1000, "Milliseconds")
+                add_metric(region, f"{stage}.items", stage_stats["items"], "Count")
+                add_metric(region, f"{stage}.items_per_second", items_per_second, "Count/Second")
+                documents[region].setdefault("stages", {})[stage] = dict(stage_stats, items_per_second=items_per_second)
+
+        emf_documents = []
+        for region in sorted(documents, key=lambda region: region or ""):
+            collected = documents[region]
+            metrics = collected.get("metrics", [])
+            dimensions = MetricsRecorder.get_dimensions(region)
+            document = {"Service": METRICS_SERVICE_NAME}
+            if region:
+                document["Region"] = region
+            document.update(collected.get("values", {}))
+            # Full histograms travel as plain properties, searchable in CloudWatch Logs Insights
+            document["LatencyHistograms"] = collected.get("histograms", {})
+            document["Stages"] = collected.get("stages", {})
+            if region is None:
+                document.update(properties or {})
+            # CloudWatch accepts at most 100 metrics per directive
+            document["_aws"] = {
+                "Timestamp": int(self.started_at * 1000),
+                "CloudWatchMetrics": [{"Namespace": self.namespace, "Dimensions": [dimensions], "Metrics": metrics[i:i + 100]}
+                                      for i in range(0, len(metrics), 100)] or [{"Namespace": self.namespace, "Dimensions": [dimensions], "Metrics": []}],
+            }
+            emf_documents.append(document)
+        return emf_documents
+
+    def emit(self, properties=None, stream=None):
+        # Lambda forwards stdout to CloudWatch Logs, which extracts the metrics from the EMF document
+        stream = stream or sys.stdout
+        for document in self.to_emf(properties):
+            stream.write(json.dumps(document, separators=(',', ':')) + "\n")
+        stream.flush()
+
+
+# Shared by every module of the lambda, reset at the start of each invocation
+recorder = MetricsRecorder()
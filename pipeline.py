@@ -0,0 +1,457 @@
+import concurrent.futures
+import queue
+import threading
+import time
+from collections import Counter
+from logger import configure_logger
+from resources import Resources
+from utility import AlarmUtility
+from validation import validate_alarm_specs
+from alarms import Alarm
+from reconcile import AlarmReconciler
+from dispatcher import AdaptiveDispatcher, DispatchCancelled
+from fingerprints import get_tags_fingerprint
+from metrics import recorder
+from plans import PlanWriter, iter_plan_pages
+from shards import MERGED_DISPATCH_STATS, get_shard, get_discovery_shard
+from config import (LOGS_LEVEL, PIPELINE_QUEUE_SIZE, MONITORING_TAG_NAME, MONITORING_TAG_VALUE, SUCCESSFULL_MONITORING_TAG_VALUE,
+                    MONITORING_TAGS_PREFIX, RESOURCE_TYPE_FILTERS)
+
+logger = configure_logger(file_name="pipeline.py", logs_level=LOGS_LEVEL)
+
+# Marks the end of the stream between two stages
+END_OF_STREAM = object()
+# Resources per page handed to process_data by TagChangePipeline, the size of a get_resources page
+TAG_CHANGE_PAGE_SIZE = 100
+# Resources per page read back from a plan by ApplyPipeline
+PLAN_PAGE_SIZE = 100
+
+
+# Streams resources from tag discovery to alarm creation:
+#   discovery (one thread per region) -> resources queue -> process_data -> alarms queue -> validate + reconcile -> dispatcher
+# Every buffer is bounded so a slow stage pushes back on the ones before it and memory stays flat whatever the fleet size.
+class AlarmPipeline:
+    def __init__(self, regions, run_context, queue_size=PIPELINE_QUEUE_SIZE, dispatcher=None, fingerprint_store=None, retry_journal=None,
+                 shard=None, retry_alarms=None):
+        self.regions = regions
+        # Collects every result of the run, the pipeline itself only keeps what reconciliation needs
+        self.run_context = run_context
+        # With a fingerprint store resources already tagged '2' are discovered as well, and processed again when their
+        # monitoring tags changed since their last success
+        self.fingerprint_store = fingerprint_store
+        self.discovery_tag_values = (MONITORING_TAG_VALUE, SUCCESSFULL_MONITORING_TAG_VALUE) if fingerprint_store is not None else MONITORING_TAG_VALUE
+        # With a retry journal resources with failed alarms waiting for a retry are left to it
+        self.retry_journal = retry_journal
+        # ResourceARN -> due specs from the journal, set once discovery finds their resource with the journaled fingerprint.
+        # Only touched by the processing thread; specs of resources not discovered this run stay in the journal.
+        self.retry_alarms = {}
+        for alarm_data in retry_alarms or ():
+            self.retry_alarms.setdefault(alarm_data.resource_arn, []).append(alarm_data)
+        # (shard index, shard count): only the discovery streams of the shard are paged, None for all of them
+        self.shard = shard
+        self.resources_queue = queue.Queue(maxsize=queue_size)
+        self.alarms_queue = queue.Queue(maxsize=queue_size)
+        self.dispatcher = dispatcher or AdaptiveDispatcher()
+        self.reconciler = AlarmReconciler()
+        # Existing alarms per region, None when they could not be fetched
+        self.existing_alarms = {}
+        self.desired_alarm_names = {}
+        # Specs a previous invocation did not get to set before its deadline, not counted as discovered alarms
+        self.resumed_alarms = run_context.pop_pending_alarms()
+
+    def discover(self, region):
+        start_time = time.perf_counter()
+        resources_count = 0
+        try:
+            logger.debug("Fetching Resources for Region: %s", region, extra={"region": region})
+            resource = Resources()
+            resource_types = self.get_resource_types(region)
+            # Resumes where a previous invocation stopped, if any
+            starting_tokens = {resource_type: self.run_context.get_pagination_token(region, resource_type) for resource_type in resource_types}
+            # Only the resource types alarms can be set on, each type paged in parallel
+            for resource_type, page, pagination_token in resource.iter_resource_type_pages(region, tag_name=MONITORING_TAG_NAME, tag_value=self.discovery_tag_values,
+                                                                                           monitoring_tags_prefix=MONITORING_TAGS_PREFIX,
+                                                                                           resource_types=resource_types, starting_tokens=starting_tokens):
+                if self.run_context.is_stopped():
+                    # Fetched again by the next invocation, from the token saved for its type
+                    break
+                if page:
+                    resources_count += len(page)
+                    self.resources_queue.put(page)
+                # Once queued a page is either set or saved as pending alarms, the next invocation starts after it
+                self.run_context.set_pagination_token(region, resource_type, pagination_token)
+        except Exception as e:
+            logger.error(f"Error fetching resources for region {region}: {str(e)}")
+        finally:
+            # Includes the time spent blocked on a full queue, i.e. waiting for the later stages
+            recorder.record_stage("discovery", time.perf_counter() - start_time, items=resources_count, region=region)
+
+    def get_resource_types(self, region):
+        # A shard pages its own streams only, together the shards page the fleet once
+        if self.shard is None:
+            return RESOURCE_TYPE_FILTERS
+        shard_index, shard_count = self.shard
+        return tuple(resource_type for resource_type in RESOURCE_TYPE_FILTERS
+                     if get_discovery_shard(region, resource_type, shard_count, self.regions) == shard_index)
+
+    def run_discovery(self):
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.regions))) as executor:
+                list(executor.map(self.discover, self.regions))
+        finally:
+            self.resources_queue.put(END_OF_STREAM)
+
+    def run_processing(self):
+        if self.resumed_alarms:
+            self.alarms_queue.put(self.resumed_alarms)
+        while True:
+            resources_data = self.resources_queue.get()
+            if resources_data is END_OF_STREAM:
+                self.alarms_queue.put(END_OF_STREAM)
+                return
+            try:
+                start_time = time.perf_counter()
+                self.run_context.count("pages")
+                self.run_context.count("resources", len(resources_data))
+                retry_alarms = []
+                if self.retry_journal is not None:
+                    resources_data, retry_alarms = self.filter_journaled_resources(resources_data)
+                if self.fingerprint_store is not None:
+                    resources_data = self.filter_unchanged_resources(resources_data)
+                alarms_data = AlarmUtility.process_data(resources_data)
+                self.run_context.count("alarms", len(alarms_data))
+                self.run_context.count("retried", len(retry_alarms))
+                alarms_data.extend(retry_alarms)
+                recorder.record_stage("process_data", time.perf_counter() - start_time, items=len(resources_data))
+                self.alarms_queue.put(alarms_data)
+            except Exception as e:
+                # Resources of the page keep their tag untouched and are picked up again by the next run
+                logger.error(f"Error processing resources page: {str(e)}")
+
+    def filter_unchanged_resources(self, resources_data):
+        stored_fingerprints = self.fingerprint_store.get_fingerprints(item['ResourceARN'] for item in resources_data)
+        changed_resources = []
+        for item in resources_data:
+            fingerprint = get_tags_fingerprint(item['Tags'])
+            # '1' asks for the alarms to be set, whatever the store says, e.g. after they were deleted by hand.
+            # A resource already done is only set again when its tags changed, or never when there is nothing to compare to.
+            if item['Tags'].get(MONITORING_TAG_NAME) != MONITORING_TAG_VALUE and stored_fingerprints.get(item['ResourceARN']) in (None, fingerprint):
+                continue
+            # Saved by the caller once the resource is known to be successful
+            self.run_context.add_resource_fingerprint(item['ResourceARN'], fingerprint)
+            changed_resources.append(item)
+        self.run_context.count("skipped", len(resources_data) - len(changed_resources))
+        return changed_resources
+
+    def filter_journaled_resources(self, resources_data):
+        # Returns the resources to process and the due specs of the journaled resources left to the journal
+        journaled_fingerprints = self.retry_journal.get_resource_fingerprints(item['ResourceARN'] for item in resources_data)
+        remaining_resources = []
+        changed_resources = []
+        retry_alarms = []
+        for item in resources_data:
+            fingerprint = get_tags_fingerprint(item['Tags'])
+            # Journaled with the fingerprint if one of its alarms fails, saved in the store once its retries succeed
+            self.run_context.add_resource_fingerprint(item['ResourceARN'], fingerprint)
+            # Due specs are dropped when the resource changed, they were built from its old tags
+            due_alarms = self.retry_alarms.pop(item['ResourceARN'], [])
+            if item['ResourceARN'] in journaled_fingerprints:
+                # Its failed alarms are retried from the journal, the others are already set
+                if journaled_fingerprints[item['ResourceARN']] == fingerprint:
+                    retry_alarms.extend(due_alarms)
+                    continue
+                changed_resources.append(item['ResourceARN'])
+            remaining_resources.append(item)
+        if changed_resources:
+            # New monitoring tags replace the journaled specs, the resource is processed again as a whole
+            self.retry_journal.delete_resources(changed_resources)
+        self.run_context.count("retrying", len(resources_data) - len(remaining_resources))
+        return remaining_resources, retry_alarms
+
+    def get_existing_alarms(self, region):
+        if region not in self.existing_alarms:
+            try:
+                self.existing_alarms[region] = self.reconciler.get_existing_alarms(region=region)
+            except Exception as e:
+                # Without a view of the existing alarms every alarm is put, like before reconciliation
+                logger.error(f"Error fetching existing alarms for region {region}: {str(e)}")
+                self.existing_alarms[region] = None
+        return self.existing_alarms[region] or {}
+
+    def dispatch_alarms(self, alarms_data):
+        if self.run_context.is_stopped():
+            # Validated, reconciled and set by the next invocation
+            self.run_context.add_pending_alarms(alarms_data)
+            return
+
+        # The same alarm name can be generated twice for a resource, the last tag wins like it did with put_metric_alarm
+        desired_alarms = {}
+        invalid_reasons = Counter()
+        for result in validate_alarm_specs(alarms_data):
+            alarm_data = result.alarm_spec
+            if result.reason is None:
+                desired_alarms[(alarm_data.region, alarm_data.alarm_name)] = alarm_data
+            else:
+                invalid_reasons[result.reason] += 1
+                self.run_context.record_alarm_outcome(alarm_data, "invalid")
+        if invalid_reasons:
+            self.run_context.count("invalid", sum(invalid_reasons.values()))
+            for reason, reason_count in invalid_reasons.items():
+                recorder.increment(f"validation.{reason}", reason_count)
+
+        for (region, alarm_name), alarm_data in desired_alarms.items():
+            self.desired_alarm_names.setdefault(region, set()).add(alarm_name)
+            action = AlarmReconciler.classify_alarm(alarm_data, self.get_existing_alarms(region))
+            self.run_context.count(action)
+            if action == "unchanged":
+                # Alarms already matching the desired spec count as successfully set
+                self.run_context.record_alarm_outcome(alarm_data, action)
+            else:
+                self.dispatcher.submit(region, Alarm.put_alarm, alarm_data, on_done=self.get_alarm_result_recorder(action))
+
+    def get_alarm_result_recorder(self, action):
+        def record_alarm_result(alarm_data, error=None):
+            if isinstance(error, DispatchCancelled):
+                # Not set, the next invocation classifies and counts it again
+                self.run_context.count(action, -1)
+                self.run_context.add_pending_alarms([alarm_data])
+                return
+            Alarm.record_alarm_result(alarm_data, self.run_context, outcome=action, error=error)
+        return record_alarm_result
+
+    def run_dispatch(self):
+        while True:
+            alarms_data = self.alarms_queue.get()
+            if alarms_data is END_OF_STREAM:
+                return
+            try:
+                start_time = time.perf_counter()
+                self.dispatch_alarms(alarms_data)
+                # Includes the time spent blocked on a full dispatcher
+                recorder.record_stage("validate_and_dispatch", time.perf_counter() - start_time, items=len(alarms_data))
+            except Exception as e:
+                logger.error(f"Error dispatching alarms: {str(e)}")
+
+    def stop(self):
+        logger.info("Deadline reached, stopping the pipeline")
+        self.run_context.stop()
+        self.dispatcher.cancel()
+
+    def start_deadline_timer(self):
+        remaining_seconds = self.run_context.deadline.get_remaining_seconds() if self.run_context.deadline else None
+        if remaining_seconds is None:
+            return None
+        if remaining_seconds <= 0:
+            logger.warning("No time left before the deadline, is the Lambda timeout shorter than the safety margin?")
+        deadline_timer = threading.Timer(remaining_seconds, self.stop)
+        deadline_timer.daemon = True
+        deadline_timer.start()
+        return deadline_timer
+
+    def run(self):
+        deadline_timer = self.start_deadline_timer()
+        discovery_thread = threading.Thread(target=self.run_discovery, name="pipeline-discovery")
+        processing_thread = threading.Thread(target=self.run_processing, name="pipeline-processing")
+        discovery_thread.start()
+        processing_thread.start()
+
+        # Validation, reconciliation and dispatch run on the calling thread
+        self.run_dispatch()
+
+        discovery_thread.join()
+        processing_thread.join()
+        dispatch_stats = self.dispatcher.wait()
+        if deadline_timer is not None:
+            deadline_timer.cancel()
+        recorder.record_stage("set_alarm", dispatch_stats["elapsed_seconds"], items=dispatch_stats["succeeded"])
+        return dict(self.run_context.counters, dispatch=dispatch_stats)
+
+    def get_orphaned_alarms(self, tagged_resource_identifiers):
+        orphaned_alarms = []
+        for region in self.regions:
+            self.get_existing_alarms(region)
+            existing_alarms = self.existing_alarms[region]
+            # Never delete anything in a region we could not fully read
+            if existing_alarms is None:
+                continue
+            orphaned_alarms.extend(AlarmReconciler.find_orphaned_alarms(region, existing_alarms, self.desired_alarm_names.get(region, set()),
+                                                                        tagged_resource_identifiers))
+        return orphaned_alarms
+
+
+# Runs the same stages on the resources of tag change events instead of a discovery scan
+class TagChangePipeline(AlarmPipeline):
+    def __init__(self, resources_data, regions, run_context, queue_size=PIPELINE_QUEUE_SIZE, dispatcher=None):
+        super().__init__(regions, run_context, queue_size=queue_size, dispatcher=dispatcher)
+        self.resources_data = resources_data
+        self.described_alarm_names = set()
+
+    def run_discovery(self):
+        try:
+            start_time = time.perf_counter()
+            for i in range(0, len(self.resources_data), TAG_CHANGE_PAGE_SIZE):
+                self.resources_queue.put(self.resources_data[i:i + TAG_CHANGE_PAGE_SIZE])
+            recorder.record_stage("discovery", time.perf_counter() - start_time, items=len(self.resources_data))
+        finally:
+            self.resources_queue.put(END_OF_STREAM)
+
+    def run_processing(self):
+        # The event says the tags changed, nothing is skipped, but the fingerprints are saved for the next full scan
+        for item in self.resources_data:
+            self.run_context.add_resource_fingerprint(item['ResourceARN'], get_tags_fingerprint(item['Tags']))
+        super().run_processing()
+
+    def dispatch_alarms(self, alarms_data):
+        # Only the alarms of the changed resources are described, not every automated alarm of the region
+        region_alarm_names = {}
+        for alarm_data in alarms_data:
+            if (alarm_data.region, alarm_data.alarm_name) not in self.described_alarm_names:
+                self.described_alarm_names.add((alarm_data.region, alarm_data.alarm_name))
+                region_alarm_names.setdefault(alarm_data.region, []).append(alarm_data.alarm_name)
+        for region, alarm_names in region_alarm_names.items():
+            if self.existing_alarms.get(region, {}) is None:
+                continue
+            try:
+                self.existing_alarms.setdefault(region, {}).update(self.reconciler.get_alarms_by_name(region, alarm_names))
+            except Exception as e:
+                logger.error(f"Error fetching existing alarms for region {region}: {str(e)}")
+                self.existing_alarms[region] = None
+        super().dispatch_alarms(alarms_data)
+
+    def start_deadline_timer(self):
+        # Event batches are small and run to the end, on a timeout their tags stay at '1' for the full scan
+        return None
+
+    def get_orphaned_alarms(self, tagged_resource_identifiers):
+        # Orphans are only known after a full scan
+        return []
+
+
+# Runs discovery and parsing only and writes the desired alarms to a plan instead of setting them
+class PlanPipeline(AlarmPipeline):
+    def __init__(self, plan_path, regions, run_context, queue_size=PIPELINE_QUEUE_SIZE, fingerprint_store=None):
+        # No retry journal, planning changes nothing, journaled resources are planned as a whole
+        super().__init__(regions, run_context, queue_size=queue_size, fingerprint_store=fingerprint_store)
+        self.plan_path = plan_path
+        self.plan_writer = None
+        self.planned_actions = Counter()
+        self.invalid_reasons = Counter()
+        self.region_alarms = Counter()
+
+    def dispatch_alarms(self, alarms_data):
+        # Validated and classified against the existing alarms for the summary only, apply does both again on what it finds then
+        desired_alarms = {}
+        for result in validate_alarm_specs(alarms_data):
+            alarm_data = result.alarm_spec
+            if result.reason is None:
+                desired_alarms[(alarm_data.region, alarm_data.alarm_name)] = alarm_data
+            else:
+                self.invalid_reasons[result.reason] += 1
+                self.run_context.count("invalid")
+        for (region, alarm_name), alarm_data in desired_alarms.items():
+            self.region_alarms[region] += 1
+            self.planned_actions[AlarmReconciler.classify_alarm(alarm_data, self.get_existing_alarms(region))] += 1
+
+        # Invalid specs are planned too, apply fails their resources like a full scan does
+        resource_alarms = {}
+        for alarm_data in alarms_data:
+            resource_alarms.setdefault(alarm_data.resource_arn, []).append(alarm_data)
+        for resource_arn, resource_alarms_data in resource_alarms.items():
+            self.plan_writer.write_resource(resource_arn, self.run_context.resource_fingerprints.get(resource_arn), resource_alarms_data)
+
+    def run(self):
+        # Stopped at the deadline the plan holds what was discovered so far, the other resources keep '1' for the next plan
+        with PlanWriter(self.plan_path) as self.plan_writer:
+            pipeline_stats = super().run()
+        summary = self.plan_writer.write_summary({
+            "run_id": self.run_context.run_id,
+            "regions": list(self.regions),
+            "complete": not self.run_context.is_stopped(),
+            "resources": pipeline_stats["resources"],
+            "skipped": pipeline_stats["skipped"],
+            "alarms": pipeline_stats["alarms"],
+            "invalid": pipeline_stats["invalid"],
+            "invalid_reasons": dict(self.invalid_reasons),
+            "actions": {action: self.planned_actions[action] for action in ("create", "update", "unchanged")},
+            "region_alarms": dict(self.region_alarms),
+        })
+        return dict(pipeline_stats, summary=summary)
+
+    def get_orphaned_alarms(self, tagged_resource_identifiers):
+        return []
+
+
+# Sets the alarms of a plan, the pages of the plan file take the place of discovery and parsing
+class ApplyPipeline(AlarmPipeline):
+    def __init__(self, plan_path, regions, run_context, queue_size=PIPELINE_QUEUE_SIZE, dispatcher=None, shard=None):
+        super().__init__(regions, run_context, queue_size=queue_size, dispatcher=dispatcher, shard=shard)
+        self.plan_path = plan_path
+
+    def run_discovery(self):
+        start_time = time.perf_counter()
+        resources_count = 0
+        try:
+            for plan_page in iter_plan_pages(self.plan_path, page_size=PLAN_PAGE_SIZE):
+                if self.run_context.is_stopped():
+                    # Applying the plan again sets the rest, the alarms already set are unchanged by then
+                    break
+                resources_count += len(plan_page)
+                self.resources_queue.put(plan_page)
+        except Exception as e:
+            # Resources after the error keep their tag untouched
+            logger.error(f"Error reading plan {self.plan_path}: {str(e)}")
+        finally:
+            recorder.record_stage("read_plan", time.perf_counter() - start_time, items=resources_count)
+            self.resources_queue.put(END_OF_STREAM)
+
+    def run_processing(self):
+        while True:
+            plan_page = self.resources_queue.get()
+            if plan_page is END_OF_STREAM:
+                self.alarms_queue.put(END_OF_STREAM)
+                return
+            if self.shard is not None:
+                shard_index, shard_count = self.shard
+                plan_page = [plan_item for plan_item in plan_page if get_shard(plan_item[0], shard_count) == shard_index]
+            self.run_context.count("pages")
+            self.run_context.count("resources", len(plan_page))
+            alarms_data = []
+            for resource_arn, fingerprint, resource_alarms_data in plan_page:
+                if fingerprint is not None:
+                    self.run_context.add_resource_fingerprint(resource_arn, fingerprint)
+                alarms_data.extend(resource_alarms_data)
+            self.run_context.count("alarms", len(alarms_data))
+            self.alarms_queue.put(alarms_data)
+
+    def get_orphaned_alarms(self, tagged_resource_identifiers):
+        # Orphans are only known after a full scan
+        return []
+
+
+# Combines the results the shards of a run saved, in place of running the stages, so the handler flips the tags once for all of them
+class MergePipeline(AlarmPipeline):
+    def __init__(self, shard_results, regions, run_context):
+        super().__init__(regions, run_context)
+        self.dispatch_stats = dict.fromkeys(MERGED_DISPATCH_STATS, 0)
+        # Orphans need every shard to have scanned to the end
+        self.complete = True
+        for results in shard_results:
+            if not results["complete"]:
+                # Its resources keep '1' and are set again by the next run, the alarms already set are unchanged by then
+                logger.warning(f"Shard {results['shard_index']} of {results['shard_count']} stopped before the end, its results are not merged")
+                self.complete = False
+                continue
+            self.run_context.merge_results(results)
+            for region, alarm_names in results["desired_alarm_names"].items():
+                self.desired_alarm_names.setdefault(region, set()).update(alarm_names)
+            # Shards run side by side, their call rates add up
+            for stat in MERGED_DISPATCH_STATS:
+                self.dispatch_stats[stat] += results["dispatch"].get(stat, 0)
+
+    def run(self):
+        return dict(self.run_context.counters, dispatch=self.dispatch_stats)
+
+    def get_orphaned_alarms(self, tagged_resource_identifiers):
+        if not self.complete:
+            return []
+        return super().get_orphaned_alarms(tagged_resource_identifiers)
@@ -0,0 +1,88 @@
+import gzip
+import json
+import time
+from alarm_spec import AlarmSpec
+from files import atomic_write
+from logger import configure_logger
+from config import LOGS_LEVEL, PLAN_PATH
+
+logger = configure_logger(file_name="plans.py", logs_level=LOGS_LEVEL)
+
+PLAN_VERSION = 1
+PLAN_MODE = "plan"
+APPLY_MODE = "apply"
+
+
+def get_plan_request(event):
+    # Returns (mode, plan path) for plan and apply events, None for any other event
+    if not isinstance(event, dict) or event.get('mode') not in (PLAN_MODE, APPLY_MODE):
+        return None
+    return event['mode'], event.get('plan_path') or PLAN_PATH
+
+
+def get_summary_path(plan_path):
+    # plan.jsonl.gz -> plan.summary.json
+    base_path = plan_path
+    for suffix in (".gz", ".jsonl"):
+        if base_path.endswith(suffix):
+            base_path = base_path[:-len(suffix)]
+    return f"{base_path}.summary.json"
+
+
+class PlanWriter:
+    # Streams the desired alarms to a gzip JSONL plan, one line per resource:
+    #   {"ResourceARN": ..., "Fingerprint": ..., "Alarms": [AlarmSpec.to_dict(), ...]}
+    # Written atomically, apply never reads half a plan.
+    def __init__(self, path=PLAN_PATH):
+        self.path = path
+        self.plan_writer = None
+        self.plan_file = None
+        self.resources = 0
+        self.alarms = 0
+
+    def __enter__(self):
+        self.plan_writer = atomic_write(self.path, "wt", opener=gzip.open, encoding="utf-8")
+        self.plan_file = self.plan_writer.__enter__()
+        return self
+
+    def write_resource(self, resource_arn, fingerprint, alarms_data):
+        line = {"ResourceARN": resource_arn, "Fingerprint": fingerprint, "Alarms": [alarm_data.to_dict() for alarm_data in alarms_data]}
+        self.plan_file.write(json.dumps(line, separators=(',', ':')))
+        self.plan_file.write("\n")
+        self.resources += 1
+        self.alarms += len(alarms_data)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.plan_writer.__exit__(exc_type, exc_value, traceback)
+
+    def write_summary(self, summary):
+        summary = dict(summary, version=PLAN_VERSION, plan_path=self.path, created_at=time.time(),
+                       planned_resources=self.resources, planned_alarms=self.alarms)
+        with atomic_write(get_summary_path(self.path)) as summary_file:
+            json.dump(summary, summary_file, indent=2, sort_keys=True)
+        return summary
+
+
+def load_plan_summary(plan_path=PLAN_PATH):
+    # Raises when there is no plan to apply, a plan is only complete once its summary is written
+    with open(get_summary_path(plan_path)) as summary_file:
+        summary = json.load(summary_file)
+    if summary.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {summary.get('version')} in {plan_path}")
+    return summary
+
+
+def iter_plan_pages(plan_path=PLAN_PATH, page_size=100):
+    # Streams the plan back in pages of (ResourceARN, fingerprint, [AlarmSpec, ...]), the whole plan is never in memory
+    page = []
+    with gzip.open(plan_path, "rt", encoding="utf-8") as plan_file:
+        for line in plan_file:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            page.append((item["ResourceARN"], item.get("Fingerprint"), [AlarmSpec.from_dict(alarm_data) for alarm_data in item["Alarms"]]))
+            if len(page) >= page_size:
+                yield page
+                page = []
+    if page:
+        yield page
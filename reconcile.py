@@ -0,0 +1,109 @@
+from clients import get_client
+from logger import configure_logger
+from metrics import recorder
+from alarms import Alarm
+from utility import AlarmUtility
+from config import LOGS_LEVEL, AUTOMATED_ALARM_NAME_PREFIX
+
+logger = configure_logger(file_name="reconcile.py", logs_level=LOGS_LEVEL)
+
+# Fields of a put_metric_alarm request that describe_alarms reports back and that we compare for drift
+COMPARED_ALARM_FIELDS = ("AlarmDescription", "Namespace", "MetricName", "Dimensions", "Threshold", "ComparisonOperator",
+                         "Statistic", "AlarmActions", "EvaluationPeriods", "DatapointsToAlarm", "Period",
+                         "ActionsEnabled", "TreatMissingData")
+
+# describe_alarms / delete_alarms accept at most 100 alarm names per call
+ALARM_NAMES_CHUNK_SIZE = 100
+
+
+class AlarmReconciler:
+    def get_existing_alarms(self, region=None, alarm_name_prefix=AUTOMATED_ALARM_NAME_PREFIX):
+        try:
+            existing_alarms = {}
+            paginator = get_client('cloudwatch', region).get_paginator('describe_alarms')
+            for page in paginator.paginate(AlarmNamePrefix=alarm_name_prefix, AlarmTypes=['MetricAlarm']):
+                recorder.increment("describe_alarms.calls", region=region)
+                for existing_alarm in page['MetricAlarms']:
+                    existing_alarms[existing_alarm['AlarmName']] = existing_alarm
+            return existing_alarms
+        except Exception as e:
+            logger.error(f"Error fetching existing alarms: {e}")
+            raise
+
+    def get_alarms_by_name(self, region, alarm_names):
+        # Only the given alarms, a handful of calls instead of every automated alarm of the region
+        try:
+            existing_alarms = {}
+            alarm_names = list(alarm_names)
+            cloudwatch_client = get_client('cloudwatch', region)
+            for i in range(0, len(alarm_names), ALARM_NAMES_CHUNK_SIZE):
+                chunk = alarm_names[i:i + ALARM_NAMES_CHUNK_SIZE]
+                with recorder.time_call("describe_alarms", region=region):
+                    response = cloudwatch_client.describe_alarms(AlarmNames=chunk, AlarmTypes=['MetricAlarm'], MaxRecords=ALARM_NAMES_CHUNK_SIZE)
+                for existing_alarm in response['MetricAlarms']:
+                    existing_alarms[existing_alarm['AlarmName']] = existing_alarm
+            return existing_alarms
+        except Exception as e:
+            logger.error(f"Error fetching alarms by name: {e}")
+            raise
+
+    @staticmethod
+    def normalize_alarm_field(field, value):
+        # Dimensions and actions are unordered on the CloudWatch side
+        if field == "Dimensions":
+            return sorted((dimension['Name'], str(dimension['Value'])) for dimension in value or [])
+        if field == "AlarmActions":
+            return sorted(value or [])
+        if field == "Threshold":
+            return float(value)
+        return value
+
+    @staticmethod
+    def is_alarm_drifted(desired_params, existing_alarm):
+        for field in COMPARED_ALARM_FIELDS:
+            desired_value = AlarmReconciler.normalize_alarm_field(field, desired_params.get(field))
+            existing_value = AlarmReconciler.normalize_alarm_field(field, existing_alarm.get(field))
+            if desired_value != existing_value:
+                logger.debug("Alarm drifted on %s: %r --> %r", field, existing_value, desired_value,
+                             extra={"stage": "reconcile", "alarm_name": desired_params['AlarmName']})
+                return True
+        return False
+
+    @staticmethod
+    def classify_alarm(alarm_data, existing_alarms):
+        existing_alarm = existing_alarms.get(alarm_data.alarm_name)
+        if existing_alarm is None:
+            return "create"
+        if AlarmReconciler.is_alarm_drifted(Alarm.build_alarm_params(alarm_data), existing_alarm):
+            return "update"
+        return "unchanged"
+
+    @staticmethod
+    def find_orphaned_alarms(region, existing_alarms, desired_alarm_names, tagged_resource_identifiers):
+        # Orphans are automated alarms whose resource no longer carries the monitoring tag at all
+        orphaned_alarms = []
+        for alarm_name in existing_alarms:
+            if alarm_name in desired_alarm_names:
+                continue
+            resource_identifier = AlarmUtility.get_alarm_resource_identifier(alarm_name)
+            if resource_identifier is not None and resource_identifier not in tagged_resource_identifiers:
+                orphaned_alarms.append({"Region": region, "AlarmName": alarm_name})
+        return orphaned_alarms
+
+    def delete_alarms(self, alarms):
+        try:
+            region_alarm_names = {}
+            for alarm in alarms:
+                region_alarm_names.setdefault(alarm['Region'], []).append(alarm['AlarmName'])
+
+            for region, alarm_names in region_alarm_names.items():
+                cloudwatch_client = get_client('cloudwatch', region)
+                for i in range(0, len(alarm_names), ALARM_NAMES_CHUNK_SIZE):
+                    chunk = alarm_names[i:i + ALARM_NAMES_CHUNK_SIZE]
+                    with recorder.time_call("delete_alarms", region=region):
+                        response = cloudwatch_client.delete_alarms(AlarmNames=chunk)
+                    logger.debug("Delete Alarms Response: %s", response, extra={"region": region})
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting alarms: {e}")
+            return False
@@ -1,75 +1,229 @@
-import boto3
+import concurrent.futures
+import queue
+import threading
+import time
+from clients import get_client
+from dispatcher import is_throttling_error, get_backoff_delay
 from logger import configure_logger
-from config import LOGS_LEVEL
+from metrics import recorder
+from metric_index import get_metric_index
+from config import LOGS_LEVEL, MODIFY_TAGS_WORKER, MODIFY_TAGS_MAX_RETRIES, RESOURCE_TYPE_FILTERS
+
+RETRYABLE_TAGGING_ERROR_CODES = frozenset({"ThrottlingException", "InternalServiceException"})
 
 logger = configure_logger(file_name="resources.py", logs_level=LOGS_LEVEL)
 
+# Marks the end of one resource type's pages in iter_resource_type_pages
+END_OF_RESOURCE_TYPE = object()
+
+# Module scope so warm invocations list the regions only once
+_enabled_regions = None
+_enabled_regions_lock = threading.Lock()
+
+
+def get_enabled_regions():
+    global _enabled_regions
+    with _enabled_regions_lock:
+        if _enabled_regions is None:
+            # describe_regions is an EC2 call, only regions enabled in the account are returned
+            with recorder.time_call("describe_regions"):
+                response = get_client('ec2').describe_regions()
+            _enabled_regions = tuple(region['RegionName'] for region in response['Regions'])
+        return _enabled_regions
+
+
 class Resources:
-    def __init__(self):
-        self.tag_client = boto3.client('resourcegroupstaggingapi')
+    # Clients are looked up per call from the region being worked on, nothing is built up front
+    @staticmethod
+    def get_arn_region(resource_arn):
+        # arn:partition:service:region:account-id:resource
+        return resource_arn.split(':')[3]
+
+    def iter_resource_token_pages(self, region, tag_name=None, tag_value=None, monitoring_tags_prefix=None, resource_type_filters=None, starting_token=None):
+        # Yields (resources, next pagination token) per get_resources page, the token is "" after the last page.
+        # Resuming from a token, e.g. one saved in a checkpoint, skips the pages before it.
+        tag_client = get_client('resourcegroupstaggingapi', region)
+        tag_filters = [{'Key': tag_name}] if tag_name else []
+        if tag_value:
+            # One value or a tuple of values, any of them matches
+            tag_filters[0]['Values'] = list(tag_value) if isinstance(tag_value, (list, tuple)) else [tag_value]
+        request_args = {'TagFilters': tag_filters, 'ResourcesPerPage': 100}
+        if resource_type_filters:
+            # Filtered server side, resources of other types are never transferred
+            request_args['ResourceTypeFilters'] = list(resource_type_filters)
+
+        pagination_token = starting_token
+        while True:
+            if pagination_token:
+                request_args['PaginationToken'] = pagination_token
+            else:
+                request_args.pop('PaginationToken', None)
+            request_started_at = time.perf_counter()
+            try:
+                page = tag_client.get_resources(**request_args)
+            except Exception as e:
+                error_code = (getattr(e, "response", None) or {}).get("Error", {}).get("Code")
+                if pagination_token and pagination_token == starting_token and error_code == "PaginationTokenExpiredException":
+                    # Too old to resume from, the resources already done are found again and come out unchanged
+                    logger.info(f"Pagination token expired in region {region}, restarting the scan")
+                    pagination_token = None
+                    continue
+                raise
+            recorder.increment("get_resources.calls", region=region)
+            recorder.record_latency("get_resources.latency", time.perf_counter() - request_started_at, region=region)
+            resources = []
+            for resource in page['ResourceTagMappingList']:
+                resource_arn = resource['ResourceARN']
+                tags = resource.get('Tags', {})
+                if isinstance(tags, list):  # Ensure tags is always a dictionary
+                    tags = {item['Key']: item['Value'] for item in tags}
+                if monitoring_tags_prefix:
+                    tags = {key: value for key, value in tags.items() if key.startswith(monitoring_tags_prefix)}
+                resources.append({'Region': region, 'ResourceARN': resource_arn, 'Tags': tags})
+            pagination_token = page.get('PaginationToken', '')
+            yield resources, pagination_token
+            if not pagination_token:
+                return
+
+    def iter_resource_type_pages(self, region, tag_name=None, tag_value=None, monitoring_tags_prefix=None, resource_types=RESOURCE_TYPE_FILTERS,
+                                 starting_tokens=None):
+        # Pages through every resource type of the region concurrently and yields (resource type, resources, next pagination token)
+        # as pages arrive, discovery takes as long as the largest type instead of the sum of all types.
+        # starting_tokens: resource type -> token to resume from, "" for types already done
+        starting_tokens = starting_tokens or {}
+        resource_types = [resource_type for resource_type in resource_types if starting_tokens.get(resource_type) != ""]
+        pages = queue.Queue(maxsize=max(1, len(resource_types)))
+        stopped = threading.Event()
+
+        def put(item):
+            # Gives up once the consumer went away, instead of blocking on a queue nobody reads anymore.
+            # Returns False when the item was dropped.
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch(resource_type):
+            token_pages = self.iter_resource_token_pages(region, tag_name=tag_name, tag_value=tag_value, monitoring_tags_prefix=monitoring_tags_prefix,
+                                                         resource_type_filters=[resource_type], starting_token=starting_tokens.get(resource_type))
+            try:
+                for page, pagination_token in token_pages:
+                    # No further get_resources call once the consumer stopped, e.g. at the deadline or after another type failed
+                    if not put((resource_type, page, pagination_token)) or stopped.is_set():
+                        break
+                else:
+                    put(END_OF_RESOURCE_TYPE)
+            except Exception as e:
+                put(e)
+            finally:
+                token_pages.close()
 
-    def get_resources(self, region=None, tag_name=None, tag_value=None, monitoring_tags_prefix=None):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(resource_types)))
+        try:
+            for resource_type in resource_types:
+                executor.submit(fetch, resource_type)
+            pending_types = len(resource_types)
+            while pending_types:
+                item = pages.get()
+                if item is END_OF_RESOURCE_TYPE:
+                    pending_types -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stopped.set()
+            executor.shutdown(wait=True)
+
+    def get_resources(self, region=None, tag_name=None, tag_value=None, monitoring_tags_prefix=None, raise_on_error=False,
+                      resource_types=RESOURCE_TYPE_FILTERS):
+        # resource_types: tagging API types to page through in parallel
         try:
             resources = []
-            regions = [region] if region else [reg['RegionName'] for reg in self.tag_client.describe_regions()['Regions']]
-
-            for reg in regions:
-                paginator = self.tag_client.get_paginator('get_resources')
-                tag_filters = [{'Key': tag_name}] if tag_name else []
-                if tag_value:
-                    tag_filters[0]['Values'] = [tag_value]
-
-                for page in paginator.paginate(TagFilters=tag_filters, ResourcesPerPage=100):
-                    for resource in page['ResourceTagMappingList']:
-                        resource_arn = resource['ResourceARN']
-                        tags = resource.get('Tags', {})
-                        if isinstance(tags, list):  # Ensure tags is always a dictionary
-                            tags = {item['Key']: item['Value'] for item in tags}
-                        if monitoring_tags_prefix:
-                            tags = {key: value for key, value in tags.items() if key.startswith(monitoring_tags_prefix)}
-                        resources.append({'Region': reg, 'ResourceARN': resource_arn, 'Tags': tags})
+            for reg in ([region] if region else get_enabled_regions()):
+                for _, page, _ in self.iter_resource_type_pages(reg, tag_name=tag_name, tag_value=tag_value, monitoring_tags_prefix=monitoring_tags_prefix,
+                                                                resource_types=resource_types):
+                    resources.extend(page)
             return resources
         except Exception as e:
             logger.error(f"Error fetching resources: {e}")
+            if raise_on_error:
+                raise
             return []
 
+    @staticmethod
+    def tag_chunk(region, chunk, tag_key, new_value):
+        # tag_resources overwrites an existing key, no need to untag first
+        tag_client = get_client('resourcegroupstaggingapi', region)
+        failed_resources = {}
+        attempt = 0
+        while chunk:
+            try:
+                with recorder.time_call("tag_resources", region=region):
+                    response = tag_client.tag_resources(
+                        ResourceARNList=chunk,
+                        Tags={tag_key: new_value}
+                    )
+                logger.debug("Create Tag Response: %s", response, extra={"stage": "modify_tag_value", "region": region})
+            except Exception as e:
+                if is_throttling_error(e):
+                    recorder.increment("tag_resources.throttles", region=region)
+                if is_throttling_error(e) and attempt < MODIFY_TAGS_MAX_RETRIES:
+                    attempt += 1
+                    recorder.increment("tag_resources.retries", region=region)
+                    time.sleep(get_backoff_delay(attempt))
+                    continue
+                logger.error(f"Error modifying tag value in region {region}: {e}")
+                failed_resources.update({resource_arn: str(e) for resource_arn in chunk})
+                return failed_resources
+
+            # Per ARN failures come back in FailedResourcesMap, only throttled and internal errors are worth a retry
+            retry_arns = []
+            for resource_arn, failure in response.get('FailedResourcesMap', {}).items():
+                if failure.get('ErrorCode') in RETRYABLE_TAGGING_ERROR_CODES and attempt < MODIFY_TAGS_MAX_RETRIES:
+                    retry_arns.append(resource_arn)
+                else:
+                    failed_resources[resource_arn] = f"{failure.get('ErrorCode')}: {failure.get('ErrorMessage')}"
+            recorder.increment("tag_resources.failed_resources", len(response.get('FailedResourcesMap', {})) - len(retry_arns), region=region)
+            chunk = retry_arns
+            if chunk:
+                attempt += 1
+                recorder.increment("tag_resources.retries", region=region)
+                time.sleep(get_backoff_delay(attempt))
+        return failed_resources
+
     def modify_tag_value(self, resources_arns, tag_key, new_value):
+        # Returns the ARNs that could not be tagged, mapped to their error
         try:
-            resources_arns = list(resources_arns)
-            # Split resources_arns into chunks of 20
-            chunks = [resources_arns[i:i + 20] for i in range(0, len(resources_arns), 20)]
-
-            for chunk in chunks:
-                # Delete the existing tag
-                response_delete = self.tag_client.untag_resources(
-                    ResourceARNList=chunk,
-                    TagKeys=[tag_key]
-                )
-                logger.debug(f"Delete Tag Response: {response_delete}")
-                # Create a new tag with the updated value
-                response_create = self.tag_client.tag_resources(
-                    ResourceARNList=chunk,
-                    Tags={tag_key: new_value}
-                )
-                logger.debug(f"Create Tag Response: {response_create}")
-
-            return True
+            # Tagging API calls must go to the region owning the resources
+            region_arns = {}
+            for resource_arn in resources_arns:
+                region_arns.setdefault(Resources.get_arn_region(resource_arn), []).append(resource_arn)
+
+            # tag_resources accepts at most 20 ARNs per call
+            chunks = [(region, arns[i:i + 20]) for region, arns in region_arns.items() for i in range(0, len(arns), 20)]
+
+            failed_resources = {}
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MODIFY_TAGS_WORKER) as executor:
+                futures = [executor.submit(Resources.tag_chunk, region, chunk, tag_key, new_value) for region, chunk in chunks]
+                for future in concurrent.futures.as_completed(futures):
+                    failed_resources.update(future.result())
+
+            if failed_resources:
+                logger.error(f"Failed to set tag {tag_key}={new_value} on {len(failed_resources)} resources")
+                logger.debug("Failed Tag Resources: %s", failed_resources)
+            return failed_resources
         except Exception as e:
             logger.error(f"Error modifying tag value: {e}")
-            return False
-        
-    def validate_alarm_metric(metric_name, namespace):
-        try:
-            cloudwatch_client = boto3.client('cloudwatch')
-            response = cloudwatch_client.list_metrics(
-                MetricName=metric_name,
-                Namespace=namespace
-            )
-            metrics = response['Metrics']
-            if metrics:
-                return True
-            else:
-                return False
-        except Exception as e:
-            logger.error(f"Error validating alarm metric: {e}")
-            return False
+            return {resource_arn: str(e) for resource_arn in resources_arns}
+
+    @staticmethod
+    def validate_alarm_metric(metric_name, namespace, region=None, dimensions=None):
+        # Returns None when the metric index of the namespace could not be loaded
+        metric_index = get_metric_index(region, namespace)
+        if metric_index is None:
+            return None
+        return metric_index.has_metric(metric_name, dimensions)
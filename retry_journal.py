@@ -0,0 +1,132 @@
+import json
+from abc import ABC, abstractmethod
+import time
+from alarm_spec import AlarmSpec
+from logger import configure_logger
+from sqlite_store import SqliteStore
+from config import LOGS_LEVEL, RETRY_JOURNAL_PATH, RETRY_JOURNAL_MAX_ATTEMPTS, RETRY_JOURNAL_BASE_DELAY, RETRY_JOURNAL_MAX_DELAY
+
+logger = configure_logger(file_name="retry_journal.py", logs_level=LOGS_LEVEL)
+
+
+def get_retry_delay(attempts, base=RETRY_JOURNAL_BASE_DELAY, cap=RETRY_JOURNAL_MAX_DELAY):
+    # Seconds until the next retry after the given number of failed attempts
+    return min(cap, base * (2 ** max(0, attempts - 1)))
+
+
+class RetryJournal(ABC):
+    # Alarms whose put_metric_alarm failed, keyed by (region, alarm name), i.e. one entry per (ResourceARN, metric).
+    # Each entry holds the spec to put again, its failed attempts and when it is due for the next one.
+
+    @abstractmethod
+    def get_due_alarms(self, now=None):
+        pass
+
+    @abstractmethod
+    def get_resource_fingerprints(self, resource_arns):
+        pass
+
+    @abstractmethod
+    def get_journaled_resources(self, resource_arns):
+        pass
+
+    @abstractmethod
+    def record_failures(self, failed_alarms, resource_fingerprints):
+        pass
+
+    @abstractmethod
+    def delete_alarms(self, alarm_keys):
+        pass
+
+    @abstractmethod
+    def delete_resources(self, resource_arns):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteRetryJournal(SqliteStore, RetryJournal):
+    def __init__(self, path=RETRY_JOURNAL_PATH, max_attempts=RETRY_JOURNAL_MAX_ATTEMPTS):
+        super().__init__(path, schema=(
+            "CREATE TABLE IF NOT EXISTS retries (region TEXT NOT NULL, alarm_name TEXT NOT NULL, resource_arn TEXT NOT NULL, "
+            "metric_name TEXT NOT NULL, spec TEXT NOT NULL, fingerprint TEXT, attempts INTEGER NOT NULL, next_retry_at REAL NOT NULL, "
+            "last_error TEXT, updated_at REAL NOT NULL, PRIMARY KEY (region, alarm_name))",
+            "CREATE INDEX IF NOT EXISTS retries_resource_arn ON retries (resource_arn)",
+        ))
+        self.max_attempts = max_attempts
+
+    def select_by_resource(self, columns, resource_arns):
+        return self.select_in(f"SELECT {columns} FROM retries WHERE resource_arn IN ({{placeholders}})", resource_arns)
+
+    def get_due_alarms(self, now=None):
+        # Specs whose next retry time has come
+        try:
+            with self.lock:
+                rows = self.connection.execute("SELECT spec FROM retries WHERE next_retry_at <= ?", (now or time.time(),)).fetchall()
+            return [AlarmSpec.from_dict(json.loads(spec)) for spec, in rows]
+        except Exception as e:
+            logger.error(f"Error reading due retries: {e}")
+            return []
+
+    def get_resource_fingerprints(self, resource_arns):
+        # ResourceARN -> fingerprint of its monitoring tags when its alarms failed, for resources with journaled alarms
+        try:
+            return dict(self.select_by_resource("resource_arn, fingerprint", resource_arns))
+        except Exception as e:
+            logger.error(f"Error reading retry journal: {e}")
+            return {}
+
+    def get_journaled_resources(self, resource_arns):
+        try:
+            return {resource_arn for resource_arn, in self.select_by_resource("DISTINCT resource_arn", resource_arns)}
+        except Exception as e:
+            logger.error(f"Error reading retry journal: {e}")
+            return set()
+
+    def record_failures(self, failed_alarms, resource_fingerprints):
+        # failed_alarms: (AlarmSpec, error) pairs. Returns the ResourceARNs that ran out of attempts, their entries are dropped.
+        exhausted_resources = set()
+        try:
+            now = time.time()
+            with self.lock, self.connection:
+                for alarm_data, error in failed_alarms:
+                    key = (alarm_data.region, alarm_data.alarm_name)
+                    row = self.connection.execute("SELECT attempts FROM retries WHERE region = ? AND alarm_name = ?", key).fetchone()
+                    attempts = (row[0] if row else 0) + 1
+                    if attempts >= self.max_attempts:
+                        exhausted_resources.add(alarm_data.resource_arn)
+                        continue
+                    self.connection.execute(
+                        "INSERT INTO retries (region, alarm_name, resource_arn, metric_name, spec, fingerprint, attempts, next_retry_at, last_error, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (region, alarm_name) DO UPDATE SET "
+                        "spec = excluded.spec, fingerprint = COALESCE(excluded.fingerprint, fingerprint), attempts = excluded.attempts, "
+                        "next_retry_at = excluded.next_retry_at, last_error = excluded.last_error, updated_at = excluded.updated_at",
+                        (alarm_data.region, alarm_data.alarm_name, alarm_data.resource_arn, alarm_data.metric_name, json.dumps(alarm_data.to_dict()),
+                         resource_fingerprints.get(alarm_data.resource_arn), attempts, now + get_retry_delay(attempts), str(error), now)
+                    )
+                self.connection.executemany("DELETE FROM retries WHERE resource_arn = ?", [(resource_arn,) for resource_arn in exhausted_resources])
+        except Exception as e:
+            # Without the journal the failures are final, like before it existed
+            logger.error(f"Error writing retry journal: {e}")
+            return {alarm_data.resource_arn for alarm_data, _ in failed_alarms}
+        return exhausted_resources
+
+    def delete_alarms(self, alarm_keys):
+        # alarm_keys: (region, alarm name) pairs that were set successfully
+        try:
+            with self.lock, self.connection:
+                self.connection.executemany("DELETE FROM retries WHERE region = ? AND alarm_name = ?", list(alarm_keys))
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting from retry journal: {e}")
+            return False
+
+    def delete_resources(self, resource_arns):
+        try:
+            with self.lock, self.connection:
+                self.connection.executemany("DELETE FROM retries WHERE resource_arn = ?", [(resource_arn,) for resource_arn in resource_arns])
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting from retry journal: {e}")
+            return False
@@ -0,0 +1,161 @@
+import threading
+import uuid
+from alarm_spec import AlarmSpec
+
+RUN_COUNTERS = ("pages", "resources", "skipped", "retrying", "retried", "alarms", "invalid", "create", "update", "unchanged", "succeeded", "failed")
+
+
+class RunContext:
+    # Results of one invocation, shared by the pipeline stages and the dispatcher threads.
+    # Created by the handler for every run and released when it ends, nothing outlives a warm invocation.
+
+    def __init__(self, run_id=None, deadline=None):
+        self.run_id = run_id or uuid.uuid4().hex
+        # Deadline of the invocation, None when it may run until it is done
+        self.deadline = deadline
+        # Set once the deadline is reached, every stage stops taking new work
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(RUN_COUNTERS, 0)
+        # (region, alarm name) -> "create" | "update" | "unchanged" | "invalid" | "failed"
+        self.alarm_outcomes = {}
+        self.successful_resources = set()
+        # Resources with an alarm that failed validation or put_metric_alarm
+        self.failed_resources = set()
+        # Resources with an alarm that failed validation, retrying can not fix them
+        self.invalid_resources = set()
+        # (region, alarm name) -> (AlarmSpec, error) of the failed put_metric_alarm calls
+        self.failed_alarms = {}
+        # ResourceARN -> fingerprint of its monitoring tags, saved once the resource succeeded
+        self.resource_fingerprints = {}
+        # (region, resource type) -> next get_resources pagination token, "" once the stream is done
+        self.pagination_tokens = {}
+        # Alarm specs not set when the run stopped, picked up first by the next invocation
+        self.pending_alarms = []
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def record_alarm_outcome(self, alarm_spec, outcome, error=None):
+        # outcome: the reconcile action for alarms that were set (or left unchanged), "invalid" or "failed" otherwise
+        failed = outcome in ("invalid", "failed")
+        with self.lock:
+            self.alarm_outcomes[(alarm_spec.region, alarm_spec.alarm_name)] = outcome
+            if failed:
+                self.failed_resources.add(alarm_spec.resource_arn)
+                if outcome == "invalid":
+                    self.invalid_resources.add(alarm_spec.resource_arn)
+                else:
+                    self.failed_alarms[(alarm_spec.region, alarm_spec.alarm_name)] = (alarm_spec, str(error))
+            else:
+                self.successful_resources.add(alarm_spec.resource_arn)
+            if error is not None or outcome == "failed":
+                self.counters["failed"] += 1
+            elif outcome in ("create", "update"):
+                self.counters["succeeded"] += 1
+
+    def get_failed_alarms(self):
+        with self.lock:
+            return list(self.failed_alarms.values())
+
+    def get_invalid_resources(self):
+        with self.lock:
+            return set(self.invalid_resources)
+
+    def get_succeeded_alarm_keys(self):
+        with self.lock:
+            return [key for key, outcome in self.alarm_outcomes.items() if outcome in ("create", "update", "unchanged")]
+
+    def add_resource_fingerprint(self, resource_arn, fingerprint):
+        with self.lock:
+            self.resource_fingerprints[resource_arn] = fingerprint
+
+    def set_pagination_token(self, region, resource_type, pagination_token):
+        with self.lock:
+            self.pagination_tokens[(region, resource_type)] = pagination_token
+
+    def get_pagination_token(self, region, resource_type):
+        # None when the stream has not been started yet
+        with self.lock:
+            return self.pagination_tokens.get((region, resource_type))
+
+    def add_pending_alarms(self, alarms_data):
+        with self.lock:
+            self.pending_alarms.extend(alarms_data)
+
+    def pop_pending_alarms(self):
+        with self.lock:
+            pending_alarms, self.pending_alarms = self.pending_alarms, []
+            return pending_alarms
+
+    def stop(self):
+        self.stopped.set()
+
+    def is_stopped(self):
+        return self.stopped.is_set()
+
+    def get_checkpoint(self, regions):
+        with self.lock:
+            return {
+                "run_id": self.run_id,
+                "regions": list(regions),
+                "counters": dict(self.counters),
+                "pagination_tokens": [[region, resource_type, pagination_token] for (region, resource_type), pagination_token in self.pagination_tokens.items()],
+                "pending_alarms": [alarm_data.to_dict() for alarm_data in self.pending_alarms],
+                "alarm_outcomes": [[region, alarm_name, outcome] for (region, alarm_name), outcome in self.alarm_outcomes.items()],
+                "successful_resources": sorted(self.successful_resources),
+                "failed_resources": sorted(self.failed_resources),
+                "invalid_resources": sorted(self.invalid_resources),
+                "failed_alarms": [[alarm_data.to_dict(), error] for alarm_data, error in self.failed_alarms.values()],
+                "resource_fingerprints": dict(self.resource_fingerprints),
+            }
+
+    def restore_checkpoint(self, checkpoint):
+        # Carries on with the results of the invocations before, counters included, so the run reports the whole scan
+        with self.lock:
+            self.counters.update(checkpoint["counters"])
+            self.pagination_tokens = {(region, resource_type): pagination_token for region, resource_type, pagination_token in checkpoint["pagination_tokens"]}
+            self.pending_alarms = [AlarmSpec.from_dict(alarm_data) for alarm_data in checkpoint["pending_alarms"]]
+            self.alarm_outcomes = {(region, alarm_name): outcome for region, alarm_name, outcome in checkpoint["alarm_outcomes"]}
+            self.successful_resources = set(checkpoint["successful_resources"])
+            self.failed_resources = set(checkpoint["failed_resources"])
+            self.invalid_resources = set(checkpoint["invalid_resources"])
+            for alarm_data, error in checkpoint["failed_alarms"]:
+                alarm_spec = AlarmSpec.from_dict(alarm_data)
+                self.failed_alarms[(alarm_spec.region, alarm_spec.alarm_name)] = (alarm_spec, error)
+            self.resource_fingerprints = dict(checkpoint["resource_fingerprints"])
+
+    def merge_results(self, results):
+        # Adds the results of a shard (a checkpoint of its run) to this one, shards never share a resource or an alarm
+        with self.lock:
+            for counter, value in results["counters"].items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+            self.alarm_outcomes.update({(region, alarm_name): outcome for region, alarm_name, outcome in results["alarm_outcomes"]})
+            self.successful_resources.update(results["successful_resources"])
+            self.failed_resources.update(results["failed_resources"])
+            self.invalid_resources.update(results["invalid_resources"])
+            for alarm_data, error in results["failed_alarms"]:
+                alarm_spec = AlarmSpec.from_dict(alarm_data)
+                self.failed_alarms[(alarm_spec.region, alarm_spec.alarm_name)] = (alarm_spec, error)
+            self.resource_fingerprints.update(results["resource_fingerprints"])
+
+    def get_successful_resources(self):
+        # A resource only succeeds when none of its alarms failed
+        with self.lock:
+            return self.successful_resources - self.failed_resources
+
+    def get_failed_resources(self):
+        with self.lock:
+            return set(self.failed_resources)
+
+    def release(self):
+        with self.lock:
+            self.alarm_outcomes.clear()
+            self.successful_resources.clear()
+            self.failed_resources.clear()
+            self.invalid_resources.clear()
+            self.failed_alarms.clear()
+            self.resource_fingerprints.clear()
+            self.pagination_tokens.clear()
+            self.pending_alarms.clear()
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+import zlib
+from events import matches_resource_type
+from files import atomic_write
+from logger import configure_logger
+from config import LOGS_LEVEL, SHARD_RESULTS_PATH, SHARD_RESULTS_MAX_AGE, RESOURCE_TYPE_FILTERS
+
+logger = configure_logger(file_name="shards.py", logs_level=LOGS_LEVEL)
+
+SHARD_RESULTS_VERSION = 1
+MERGE_MODE = "merge"
+# Dispatcher stats a shard saves for the merge
+MERGED_DISPATCH_STATS = ("calls", "succeeded", "failed", "retries", "throttles", "cancelled", "calls_per_second")
+
+
+def get_shard(resource_arn, shard_count):
+    # Shard of an apply, which reads its resources from the plan and can split them evenly.
+    # Stable across processes and invocations, unlike hash() which is salted per process.
+    # Alarms belong to the shard of their resource, so each alarm is owned by exactly one shard.
+    return zlib.crc32(resource_arn.encode('utf-8')) % shard_count
+
+
+def get_discovery_shard(region, resource_type, shard_count, regions, resource_types=RESOURCE_TYPE_FILTERS):
+    # Shard of a full scan: the tagging API can not filter by ARN hash, so the shards split the discovery streams, one per
+    # (region, resource type), round robin in a stable order. Each stream is paged by one shard only.
+    streams = [(stream_region, stream_type) for stream_region in sorted(regions) for stream_type in sorted(resource_types)]
+    return streams.index((region, resource_type)) % shard_count
+
+
+def get_resource_shard(resource_arn, shard_count, regions, resource_types=RESOURCE_TYPE_FILTERS):
+    # Shard of a full scan that discovers the resource, e.g. for its due retries; by ARN hash when no stream finds it
+    region = resource_arn.split(':')[3]
+    resource_type = next((resource_type for resource_type in resource_types if matches_resource_type(resource_arn, resource_type)), None)
+    if region not in regions or resource_type is None:
+        return get_shard(resource_arn, shard_count)
+    return get_discovery_shard(region, resource_type, shard_count, regions, resource_types)
+
+
+def get_shard_request(event):
+    # Returns (shard index, shard count) for events running one shard, None for any other event
+    if not isinstance(event, dict) or event.get('shard_count') is None or event.get('mode') == MERGE_MODE:
+        return None
+    shard_count = int(event['shard_count'])
+    shard_index = int(event.get('shard_index', -1))
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {event.get('shard_index')} of {event['shard_count']}")
+    return shard_index, shard_count
+
+
+def get_merge_request(event):
+    # Returns the shard count for merge events, None for any other event
+    if not isinstance(event, dict) or event.get('mode') != MERGE_MODE:
+        return None
+    shard_count = int(event['shard_count'])
+    if shard_count < 1:
+        raise ValueError(f"Invalid shard count {event['shard_count']}")
+    return shard_count
+
+
+class ShardResultStore:
+    # One JSON file per shard with the results of its run, RunContext.get_checkpoint plus what the merge needs
+    def __init__(self, path=SHARD_RESULTS_PATH, max_age=SHARD_RESULTS_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+
+    def get_result_path(self, shard_index, shard_count):
+        return os.path.join(self.path, f"shard-{shard_index}-of-{shard_count}.json")
+
+    def save(self, shard_index, shard_count, results):
+        results = dict(results, version=SHARD_RESULTS_VERSION, shard_index=shard_index, shard_count=shard_count, saved_at=time.time())
+        os.makedirs(self.path, exist_ok=True)
+        # The merge never reads half a result
+        with atomic_write(self.get_result_path(shard_index, shard_count)) as result_file:
+            json.dump(results, result_file, separators=(',', ':'))
+
+    def load_all(self, shard_count):
+        # Raises unless every shard saved recent results, tags are only flipped from a complete set of shards
+        shard_results = []
+        for shard_index in range(shard_count):
+            result_path = self.get_result_path(shard_index, shard_count)
+            try:
+                with open(result_path) as result_file:
+                    results = json.load(result_file)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"No results of shard {shard_index} of {shard_count} in {self.path}") from None
+            if results.get("version") != SHARD_RESULTS_VERSION or time.time() - results.get("saved_at", 0) > self.max_age:
+                raise ValueError(f"Outdated results of shard {shard_index} of {shard_count} in {self.path}")
+            shard_results.append(results)
+        return shard_results
+
+    def clear(self, shard_count):
+        for shard_index in range(shard_count):
+            try:
+                os.remove(self.get_result_path(shard_index, shard_count))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error removing results of shard {shard_index}: {e}")
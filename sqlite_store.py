@@ -0,0 +1,33 @@
+import threading
+
+# SQLite limits the number of bound parameters per statement
+SQLITE_QUERY_CHUNK_SIZE = 500
+
+
+class SqliteStore:
+    # One SQLite connection shared by the pipeline threads, every statement runs under the lock.
+    # schema: CREATE statements run once when the store is opened.
+    def __init__(self, path, schema=()):
+        # sqlite3 is imported on first use only, like boto3
+        import sqlite3
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            for statement in schema:
+                self.connection.execute(statement)
+
+    def select_in(self, query, values):
+        # query holds one {placeholders} for the IN list, run once per chunk of values
+        values = list(values)
+        rows = []
+        with self.lock:
+            for i in range(0, len(values), SQLITE_QUERY_CHUNK_SIZE):
+                chunk = values[i:i + SQLITE_QUERY_CHUNK_SIZE]
+                rows.extend(self.connection.execute(query.format(placeholders=','.join('?' * len(chunk))), chunk))
+        return rows
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Measures the cold start cost of the lambda in fresh interpreters: import time of main.py, whether boto3 got
+# imported with it, and the latency of the first and of a second (warm) invocation against fake_aws.
+#   python startup_benchmark.py --runs 5
+
+PROBE = """
+import contextlib, functools, io, json, logging, os, sys, time
+start_time = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - start_time
+boto3_imported = "boto3" in sys.modules
+modules_count = len(sys.modules)
+
+import clients
+from checkpoints import FileCheckpointStore
+from fake_aws import FakeAWS
+from config import MONITORING_TAGS_PREFIX, SNS_TOPIC_ARNS, SETTINGS
+fake_aws = FakeAWS()
+fake_aws.add_synthetic_fleet({fleet_size}, list(SETTINGS.regions), monitoring_tags_prefix=MONITORING_TAGS_PREFIX, sns_topic_arn=SNS_TOPIC_ARNS[0])
+clients.set_client_factory(fake_aws.client)
+# Every probe must see the whole fleet as new, and leaves no store behind where a real local run would read it
+main.SETTINGS = SETTINGS._replace(incremental_discovery=False, fingerprint_store_path=os.path.join({store_path!r}, "fingerprints.sqlite3"),
+                                  retry_journal_path=os.path.join({store_path!r}, "retries.sqlite3"))
+main.FileCheckpointStore = functools.partial(FileCheckpointStore, path=os.path.join({store_path!r}, "checkpoint.json"))
+logging.disable(logging.WARNING)
+
+invocations = []
+for _ in range(2):
+    # The warm run finds the same tagged fleet, its alarms already exist
+    for region_resources in fake_aws.resources.values():
+        for tags in region_resources.values():
+            tags[SETTINGS.monitoring_tag_name] = SETTINGS.monitoring_tag_value
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.lambda_handler(event={{}}, context=None)
+    invocations.append(time.perf_counter() - start_time)
+
+print(json.dumps({{"import_seconds": import_seconds, "boto3_imported_at_import": boto3_imported, "modules_after_import": modules_count,
+                  "first_invocation_seconds": invocations[0], "warm_invocation_seconds": invocations[1]}}))
+"""
+
+
+def run_probe(fleet_size):
+    environment = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    with tempfile.TemporaryDirectory() as store_path:
+        output = subprocess.run([sys.executable, "-c", PROBE.format(fleet_size=fleet_size, store_path=store_path)],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), env=environment, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the lambda entry point")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    # Kept small: put_metric_alarm goes through the rate limited dispatcher, which would dominate the timing
+    parser.add_argument("--fleet-size", type=int, default=2, help="synthetic resources served by fake_aws")
+    args = parser.parse_args()
+
+    probes = [run_probe(args.fleet_size) for _ in range(args.runs)]
+    for key in ("import_seconds", "first_invocation_seconds", "warm_invocation_seconds"):
+        values = [probe[key] for probe in probes]
+        print(f"{key:<26} median {statistics.median(values) * 1000:8.1f} ms   min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+    print(f"{'modules_after_import':<26} {probes[0]['modules_after_import']}")
+    print(f"{'boto3_imported_at_import':<26} {any(probe['boto3_imported_at_import'] for probe in probes)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import functools
+import pytest
+import clients
+import fake_aws
+import main
+from checkpoints import FileCheckpointStore, LocalContext
+from config import SNS_TOPIC_ARNS, MONITORING_TAG_NAME, SUCCESSFULL_MONITORING_TAG_VALUE
+
+REGION = "us-west-2"
+FLEET_SIZE = 12
+
+
+@pytest.fixture
+def run(monkeypatch, tmp_path):
+    # A fake fleet and every store of the handler under tmp_path, with the deadline at the Lambda timeout
+    aws = fake_aws.FakeAWS(latency=0.01)
+    aws.add_synthetic_fleet(FLEET_SIZE, [REGION], sns_topic_arn=SNS_TOPIC_ARNS[0])
+    clients.set_client_factory(aws.client)
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    monkeypatch.setattr(main, "SETTINGS", main.SETTINGS._replace(regions=(REGION,), checkpoints_enabled=True, deadline_safety_margin_ms=0,
+                                                                 emit_metrics=False, fingerprint_store_path=str(tmp_path / "fingerprints.db"),
+                                                                 retry_journal_path=str(tmp_path / "retries.db")))
+    monkeypatch.setattr(main, "FileCheckpointStore", functools.partial(FileCheckpointStore, path=checkpoint_path))
+    yield aws, FileCheckpointStore(path=checkpoint_path)
+    # Later tests must not talk to this fleet
+    clients.set_client_factory(None)
+
+
+def get_monitoring_tag_values(aws):
+    return [tags[MONITORING_TAG_NAME] for tags in aws.resources[REGION].values()]
+
+
+def test_stopped_run_resumes_from_checkpoint(run):
+    aws, checkpoint_store = run
+
+    # Dispatch starts slow, the deadline stops the run long before every alarm is set
+    response = main.lambda_handler({}, LocalContext(timeout_ms=300))
+    assert response["statusCode"] == 200
+    checkpoint = checkpoint_store.load()
+    assert checkpoint is not None
+    assert checkpoint["pending_alarms"] or any(pagination_token != "" for _, _, pagination_token in checkpoint["pagination_tokens"])
+    set_alarms = len(aws.alarms.get(REGION, {}))
+    assert aws.call_counts.get("put_metric_alarm", 0) == set_alarms
+    # Nothing is tagged as done until the scan is complete
+    assert SUCCESSFULL_MONITORING_TAG_VALUE not in get_monitoring_tag_values(aws)
+
+    for _ in range(5):
+        main.lambda_handler({}, LocalContext(timeout_ms=60000))
+        if checkpoint_store.load() is None:
+            break
+    assert checkpoint_store.load() is None
+    assert get_monitoring_tag_values(aws) == [SUCCESSFULL_MONITORING_TAG_VALUE] * FLEET_SIZE
+    assert len(aws.alarms[REGION]) > set_alarms
+    # Alarms set before the stop are not put again
+    assert aws.call_counts["put_metric_alarm"] == len(aws.alarms[REGION])
+
+
+def test_outdated_checkpoint_is_dropped(tmp_path):
+    checkpoint_store = FileCheckpointStore(path=str(tmp_path / "checkpoint.json"), max_age=-1)
+    assert checkpoint_store.save({"run_id": "stopped", "regions": [REGION]})
+    assert checkpoint_store.load() is None
+    assert not (tmp_path / "checkpoint.json").exists()
@@ -0,0 +1,44 @@
+import concurrent.futures
+import pytest
+import clients
+import fake_aws
+import metric_index
+
+REGION = "us-west-2"
+
+
+@pytest.fixture
+def aws():
+    # Fresh module caches, warm invocations share them otherwise
+    metric_index.clear_metric_indexes()
+    aws = fake_aws.FakeAWS()
+    aws.add_synthetic_fleet(10, [REGION])
+    clients.set_client_factory(aws.client)
+    yield aws
+    clients.set_client_factory(None)
+    metric_index.clear_metric_indexes()
+
+
+def test_failed_load_is_not_retried_per_alarm(aws, monkeypatch):
+    calls = []
+
+    def denied_list_metrics(self, **kwargs):
+        calls.append(kwargs)
+        raise fake_aws.FakeClientError("AccessDenied", "list_metrics")
+
+    monkeypatch.setattr(fake_aws.FakeCloudWatchClient, "list_metrics", denied_list_metrics)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        metric_indexes = list(executor.map(lambda _: metric_index.get_metric_index(REGION, "AWS/RDS"), range(60)))
+    assert metric_indexes == [None] * 60
+    assert len(calls) == 1
+
+    # Tried again once the failure is older than its TTL
+    assert metric_index.get_metric_index(REGION, "AWS/RDS", failure_ttl=-1) is None
+    assert len(calls) == 2
+
+
+def test_index_is_loaded_once_per_namespace(aws):
+    first_index = metric_index.get_metric_index(REGION, "AWS/RDS")
+    assert first_index is not None
+    assert metric_index.get_metric_index(REGION, "AWS/RDS") is first_index
+    assert aws.call_counts["list_metrics"] == 1
@@ -0,0 +1,51 @@
+import time
+import pytest
+import clients
+import fake_aws
+from config import MONITORING_TAG_NAME, MONITORING_TAG_VALUE, MONITORING_TAGS_PREFIX, RESOURCE_TYPE_FILTERS
+from resources import Resources
+
+REGION = "us-west-2"
+FLEET_SIZE = 20000
+
+
+@pytest.fixture
+def aws():
+    aws = fake_aws.FakeAWS(latency=0.01)
+    aws.add_synthetic_fleet(FLEET_SIZE, [REGION])
+    clients.set_client_factory(aws.client)
+    yield aws
+    clients.set_client_factory(None)
+
+
+def iter_pages(**kwargs):
+    return Resources().iter_resource_type_pages(REGION, tag_name=MONITORING_TAG_NAME, tag_value=MONITORING_TAG_VALUE,
+                                                monitoring_tags_prefix=MONITORING_TAGS_PREFIX, **kwargs)
+
+
+def test_stopped_discovery_makes_no_further_calls(aws):
+    pages = iter_pages()
+    next(pages)
+    # What the pipeline does at the deadline: it stops reading and closes the generator
+    calls_before_stop = aws.call_counts["get_resources"]
+    pages.close()
+    # Only the calls in flight when it stopped, at most one per type, complete; the fleet takes over 200 pages
+    calls_after_stop = aws.call_counts["get_resources"]
+    assert calls_after_stop - calls_before_stop <= len(RESOURCE_TYPE_FILTERS)
+    time.sleep(0.1)
+    assert aws.call_counts["get_resources"] == calls_after_stop
+
+
+def test_failed_resource_type_stops_the_others(aws, monkeypatch):
+    get_resources = fake_aws.FakeTaggingClient.get_resources
+
+    def failing_get_resources(self, ResourceTypeFilters=None, **kwargs):
+        if ResourceTypeFilters == [RESOURCE_TYPE_FILTERS[0]] and kwargs.get("PaginationToken"):
+            raise fake_aws.FakeClientError("InternalServiceException", "get_resources")
+        return get_resources(self, ResourceTypeFilters=ResourceTypeFilters, **kwargs)
+
+    monkeypatch.setattr(fake_aws.FakeTaggingClient, "get_resources", failing_get_resources)
+    with pytest.raises(fake_aws.FakeClientError):
+        for _ in iter_pages():
+            pass
+    assert aws.call_counts["get_resources"] <= 3 * len(RESOURCE_TYPE_FILTERS)
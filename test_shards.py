@@ -0,0 +1,26 @@
+from config import RESOURCE_TYPE_FILTERS
+from fake_aws import SYNTHETIC_RESOURCE_TYPES
+from shards import get_discovery_shard, get_resource_shard
+
+REGIONS = ("us-west-2", "eu-west-1")
+
+
+def test_discovery_streams_are_split_across_shards():
+    shard_count = 3
+    stream_shards = {(region, resource_type): get_discovery_shard(region, resource_type, shard_count, REGIONS)
+                     for region in REGIONS for resource_type in RESOURCE_TYPE_FILTERS}
+    assert set(stream_shards.values()) == set(range(shard_count))
+    # Round robin: no shard pages more than one stream more than another
+    streams_per_shard = [list(stream_shards.values()).count(shard_index) for shard_index in range(shard_count)]
+    assert max(streams_per_shard) - min(streams_per_shard) <= 1
+    # The order of the configured regions does not matter
+    assert all(get_discovery_shard(region, resource_type, shard_count, tuple(reversed(REGIONS))) == shard_index
+               for (region, resource_type), shard_index in stream_shards.items())
+
+
+def test_resource_shard_is_the_shard_discovering_it():
+    for index, (arn_template, _, _) in enumerate(SYNTHETIC_RESOURCE_TYPES):
+        for region in REGIONS:
+            resource_arn = arn_template.format(region=region, index=index)
+            resource_type = next(resource_type for resource_type in RESOURCE_TYPE_FILTERS if resource_arn.split(':')[2] == resource_type.split(':')[0])
+            assert get_resource_shard(resource_arn, 4, REGIONS) == get_discovery_shard(region, resource_type, 4, REGIONS)
@@ -0,0 +1,94 @@
+from collections import namedtuple
+from alarm_spec import ALARM_SPEC_FIELDS
+from resources import Resources
+from logger import configure_logger
+from config import (LOGS_LEVEL, STATISTIC_MAP, COMPARISON_OPERATOR_MAP, RESOURCE_DIMENSIONS_MAP, SNS_TOPIC_ARNS, METRICS_VALIDATION_MAP,
+                    DYNAMIC_METRIC_VALIDATION)
+
+logger = configure_logger(file_name="validation.py", logs_level=LOGS_LEVEL)
+
+# Reason codes of the validation results, None for a valid spec
+MISSING_FIELD = "MISSING_FIELD"
+EMPTY_FIELD = "EMPTY_FIELD"
+INVALID_NAMESPACE = "INVALID_NAMESPACE"
+INVALID_METRIC = "INVALID_METRIC"
+INVALID_SNS_TOPIC = "INVALID_SNS_TOPIC"
+INVALID_STATISTIC = "INVALID_STATISTIC"
+INVALID_COMPARISON_OPERATOR = "INVALID_COMPARISON_OPERATOR"
+INVALID_DATAPOINTS = "INVALID_DATAPOINTS"
+INVALID_THRESHOLD = "INVALID_THRESHOLD"
+
+# Built once at import, every check below is a set lookup
+VALID_NAMESPACES = frozenset(RESOURCE_DIMENSIONS_MAP)
+VALID_SNS_TOPIC_ARNS = frozenset(SNS_TOPIC_ARNS)
+VALID_STATISTICS = frozenset(STATISTIC_MAP.values())
+VALID_COMPARISON_OPERATORS = frozenset(COMPARISON_OPERATOR_MAP.values())
+NAMESPACE_METRICS = {namespace: frozenset(metric_names) for namespace, metric_names in METRICS_VALIDATION_MAP.items()}
+NO_METRICS = frozenset()
+
+
+class ValidationResult(namedtuple("ValidationResult", ["alarm_spec", "reason", "value"])):
+    # reason: one of the reason codes above, None when the spec is valid; value: what failed the check
+    __slots__ = ()
+
+    @property
+    def is_valid(self):
+        return self.reason is None
+
+
+def validate_alarm_spec(alarm_data, dynamic_metric_validation=DYNAMIC_METRIC_VALIDATION):
+    # Check if all required fields are present
+    if None in alarm_data:
+        return ValidationResult(alarm_data, MISSING_FIELD, ALARM_SPEC_FIELDS[alarm_data.index(None)])
+
+    # Check if no field has an empty value
+    if '' in alarm_data:
+        return ValidationResult(alarm_data, EMPTY_FIELD, ALARM_SPEC_FIELDS[alarm_data.index('')])
+
+    # Unpacked once, attribute access on the namedtuple costs more than the checks themselves
+    region, _, namespace, sns_topic_arn, metric_name, statistic, comparison_operator, threshold, datapoints, dimensions, _ = alarm_data
+
+    if namespace not in VALID_NAMESPACES:
+        return ValidationResult(alarm_data, INVALID_NAMESPACE, namespace)
+
+    # Validate Metric against the metrics CloudWatch reports for this resource's dimensions
+    metric_exists = None
+    if dynamic_metric_validation:
+        metric_exists = Resources.validate_alarm_metric(metric_name=metric_name, namespace=namespace, region=region, dimensions=dimensions)
+    # Statically, also the fallback when the metric index is not available
+    if metric_exists is None:
+        metric_exists = metric_name in NAMESPACE_METRICS.get(namespace, NO_METRICS)
+    if not metric_exists:
+        return ValidationResult(alarm_data, INVALID_METRIC, metric_name)
+
+    if sns_topic_arn not in VALID_SNS_TOPIC_ARNS:
+        return ValidationResult(alarm_data, INVALID_SNS_TOPIC, sns_topic_arn)
+
+    if statistic not in VALID_STATISTICS:
+        return ValidationResult(alarm_data, INVALID_STATISTIC, statistic)
+
+    if comparison_operator not in VALID_COMPARISON_OPERATORS:
+        return ValidationResult(alarm_data, INVALID_COMPARISON_OPERATOR, comparison_operator)
+
+    try:
+        if int(datapoints) <= 0:
+            return ValidationResult(alarm_data, INVALID_DATAPOINTS, datapoints)
+    except ValueError:
+        return ValidationResult(alarm_data, INVALID_DATAPOINTS, datapoints)
+
+    try:
+        float(threshold)
+    except ValueError:
+        return ValidationResult(alarm_data, INVALID_THRESHOLD, threshold)
+
+    return ValidationResult(alarm_data, None, None)
+
+
+def validate_alarm_specs(alarms_data, dynamic_metric_validation=DYNAMIC_METRIC_VALIDATION):
+    # One pass over a list or a stream of specs, yields a ValidationResult per spec in the same order
+    for alarm_data in alarms_data:
+        result = validate_alarm_spec(alarm_data, dynamic_metric_validation)
+        if result.reason is not None:
+            logger.error("Invalid alarm %s: %s %r", alarm_data.alarm_name, result.reason, result.value,
+                         extra={"region": alarm_data.region, "resource_arn": alarm_data.resource_arn, "alarm_name": alarm_data.alarm_name})
+        yield result